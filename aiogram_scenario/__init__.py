@@ -1,6 +1,8 @@
 from .fsm.fsm import FSM
 from .fsm.trigger import FSMTrigger
 from .fsm.middleware import FSMMiddleware
+from .fsm.scheduler import SchedulerMiddleware
+from .fsm.offloading import offload
 from .fsm.state import BaseState
 from .fsm.states_group import StatesGroupMixin
 from .registrars.handlers import HandlersRegistrar
@@ -11,6 +13,8 @@ __all__ = [
     "FSM",
     "FSMTrigger",
     "FSMMiddleware",
+    "SchedulerMiddleware",
+    "offload",
     "BaseState",
     "StatesGroupMixin",
     "HandlersRegistrar",
@@ -76,6 +76,20 @@ class TransitionIsLockedError(BaseError):
                 f"(chat_id={self.chat_id}, user_id={self.user_id}) because there is an active lock!'")
 
 
+class HookTimeoutError(BaseError):
+
+    def __init__(self, state: BaseState, hook: str, timeout: float):
+
+        self.state = state
+        self.hook = hook
+        self.timeout = timeout
+
+    @property
+    def message(self) -> str:
+
+        return f"{self.hook} hook of the state '{self.state}' is not completed in {self.timeout} seconds!"
+
+
 class TransitionAddingError(BaseError):
 
     def __init__(self, source_state: BaseState, destination_state: BaseState,
@@ -237,6 +251,14 @@ class FSMIsNotInitializedError(BaseError):
         return "FSM has not been initialized!"
 
 
+class FSMIsFrozenError(BaseError):
+
+    @property
+    def message(self) -> str:
+
+        return "FSM is frozen, transitions can no longer be changed!"
+
+
 class MagazineIsNotLoadedError(BaseError):
 
     def __init__(self, chat_id: int, user_id: int):
@@ -250,6 +272,34 @@ class MagazineIsNotLoadedError(BaseError):
         return "magazine is not loaded!"
 
 
+class MagazineIsChangedError(BaseError):
+
+    def __init__(self, chat_id: int, user_id: int, expected_state, current_state):
+
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.expected_state = expected_state
+        self.current_state = current_state
+
+    @property
+    def message(self) -> str:
+
+        return (f"magazine has been changed concurrently, expected state '{self.expected_state}' "
+                f"but found '{self.current_state}' (chat_id={self.chat_id}, user_id={self.user_id})!")
+
+
+class MagazinePayloadDecodingError(BaseError):
+
+    def __init__(self, payload: bytes):
+
+        self.payload = payload
+
+    @property
+    def message(self) -> str:
+
+        return f"failed to decode magazine payload {self.payload!r}!"
+
+
 class StateValueIsAlreadyExistsError(BaseError):
 
     def __init__(self, value, state):
@@ -274,3 +324,16 @@ class StateIsNotUsedInTransitions(BaseError):
 
         return (f"The state '{self.state}' was not found in the transitions, "
                 f"which means that it is impossible to make a transition either to it or from it!")
+
+
+class StorageTransactionIsActiveError(BaseError):
+
+    def __init__(self, chat_id: int, user_id: int):
+
+        self.chat_id = chat_id
+        self.user_id = user_id
+
+    @property
+    def message(self) -> str:
+
+        return f"storage transaction is already active (chat_id={self.chat_id}, user_id={self.user_id})!"
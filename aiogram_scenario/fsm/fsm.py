@@ -1,13 +1,21 @@
+import asyncio
 import inspect
-from typing import Optional, Callable, Iterable, Union
+import time
+from typing import Optional, Callable, Iterable, Union, Dict, Tuple, FrozenSet, List, ContextManager, Awaitable
 import logging
 
 from aiogram import Dispatcher
 
 from .state import BaseState
 from .states_mapping import StatesMapping
+from .metrics import FSMMetrics, ENTER_HOOK, EXIT_HOOK
+from .offloading import HooksExecutor, HookOffloading, get_hook_offloading
+from .tracing import (AbstractTransitionTracer, TransitionTrace, trace_phase, NULL_CONTEXT,
+                      LOAD_PHASE, LOCK_PHASE, EXIT_PHASE, ENTER_PHASE, COMMIT_PHASE)
 from .storages.base import BaseStorage, Magazine
+from .storages.base.storage import AddressType
 from .transitions.keeper import TransitionsKeeper
+from .transitions.table import TransitionsTable
 from .transitions.locking.storages.base import AbstractLockingStorage
 from .transitions.locking.storages.memory import MemoryLockingStorage
 from .types import RawTransitionsType
@@ -18,33 +26,61 @@ from aiogram_scenario import errors
 logger = logging.getLogger(__name__)
 
 
-def _get_spec_kwargs(callback: Callable, kwargs: dict) -> dict:
+AcceptedKwargsType = Optional[FrozenSet[str]]  # None - any keyword arguments are accepted
+TransitionResolverType = Callable[[Magazine], Tuple[BaseState, BaseState]]  # magazine -> (source, destination)
+
+
+def _get_accepted_kwargs(callback: Callable) -> AcceptedKwargsType:
 
     spec = inspect.getfullargspec(callback)
 
     if spec.varkw:
+        return None
+    else:
+        return frozenset(spec.args + spec.kwonlyargs)
+
+
+def _filter_kwargs(accepted_kwargs: AcceptedKwargsType, kwargs: dict) -> dict:
+
+    if accepted_kwargs is None:
         return kwargs
     else:
-        return {k: v for k, v in kwargs.items() if k in set(spec.args + spec.kwonlyargs)}
+        return {k: v for k, v in kwargs.items() if k in accepted_kwargs}
 
 
 class FSM:
 
     def __init__(self, dispatcher: Dispatcher, *, locking_storage: Optional[AbstractLockingStorage] = None,
-                 initial_state: Optional[BaseState] = None):
+                 initial_state: Optional[BaseState] = None, magazine_depth: Optional[int] = None,
+                 lock_timeout: Optional[float] = None, metrics: Optional[FSMMetrics] = None,
+                 tracer: Optional[AbstractTransitionTracer] = None, hooks_executor: Optional[HooksExecutor] = None,
+                 hooks_timeout: Optional[float] = None, transactional: bool = False):
 
         if not isinstance(dispatcher.storage, BaseStorage):  # in case of storage from aiogram
             raise errors.InvalidFSMStorageTypeError(type(dispatcher.storage))
+        if (hooks_timeout is not None) and (hooks_timeout <= 0):
+            raise ValueError("hooks timeout must be a positive number!")
 
         self._dispatcher = dispatcher
+        if magazine_depth is not None:
+            self.storage.magazine_depth = magazine_depth
         self._states_mapping = StatesMapping()
+        self._hooks_kwargs: Dict[BaseState, Tuple[AcceptedKwargsType, AcceptedKwargsType]] = {}  # (exit, enter)
+        self._hooks_offloading: Dict[BaseState, Tuple[Optional[HookOffloading], Optional[HookOffloading]]] = {}
+        self._hooks_executor = hooks_executor  # the default one is created for the first offloaded hook
+        self._hooks_timeout = hooks_timeout  # None - hooks are not limited in time
+        self._transactional = transactional  # writes of hooks to the storage are committed with the state
+        self._metrics = metrics
+        self._tracer = tracer
 
         self._initial_state: Optional[BaseState] = None
         if initial_state is not None:
             self.set_initial_state(initial_state)
 
         self._locking_storage = locking_storage or MemoryLockingStorage()
+        self._lock_timeout = lock_timeout  # None - do not wait for the lock release
         self._transitions_keeper = TransitionsKeeper()
+        self._transitions_table: Optional[TransitionsTable] = None
         self.handlers_registrar = FSMHandlersRegistrar(self._dispatcher, self._states_mapping)
 
     @property
@@ -52,6 +88,11 @@ class FSM:
 
         return self._initial_state is not None
 
+    @property
+    def is_frozen(self) -> bool:
+
+        return self._transitions_table is not None
+
     @property
     def initial_state(self) -> Optional[BaseState]:
 
@@ -62,6 +103,24 @@ class FSM:
 
         self.set_initial_state(state)
 
+    @property
+    def metrics(self) -> Optional[FSMMetrics]:
+
+        return self._metrics
+
+    @property
+    def tracer(self) -> Optional[AbstractTransitionTracer]:
+
+        return self._tracer
+
+    @property
+    def hooks_executor(self) -> HooksExecutor:
+
+        if self._hooks_executor is None:
+            self._hooks_executor = HooksExecutor()
+
+        return self._hooks_executor
+
     @property
     def storage(self) -> BaseStorage:
 
@@ -74,16 +133,47 @@ class FSM:
 
         self._initial_state = state
         self._states_mapping.add(None, state)
+        self._cache_hooks_kwargs(state)
+        if self._metrics is not None:
+            self._metrics.register_state(state.name)
 
         logger.info(f"Initial state '{state}' is set!")
 
     async def get_current_state(self, *, chat_id: int, user_id: int) -> BaseState:
 
         value = await self.storage.get_state(chat=chat_id, user=user_id)
-        state = self._states_mapping.get_state(value)
+        state = self._get_state(value)
 
         return state
 
+    async def get_current_states(self, addresses: Iterable[AddressType]) -> Dict[AddressType, BaseState]:
+
+        magazines_states = await self.storage.get_magazines_states(addresses)
+
+        return {address: self._get_state(states[-1]) for address, states in magazines_states.items()}
+
+    async def count_occupancy(self, *, batch_size: int = 1000) -> Dict[BaseState, int]:
+
+        occupancy = dict.fromkeys(self._transitions.states, 0)
+        async for _, _, states in self.storage.iter_magazines(batch_size=batch_size):
+            state = self._get_state(states[-1])
+            occupancy[state] = occupancy.get(state, 0) + 1
+
+        if self._metrics is not None:  # users without stored magazines are not counted in the initial state
+            self._metrics.set_occupancy({state.name: count for state, count in occupancy.items()})
+
+        return occupancy
+
+    def freeze(self) -> None:
+
+        self._check_initialization()
+        if self.is_frozen:
+            raise errors.FSMIsFrozenError()
+
+        self._transitions_table = TransitionsTable(self._transitions_keeper, self._states_mapping)
+
+        logger.info(f"FSM is frozen ({len(self._transitions_table)} transitions)!")
+
     def add_transition(self, source_state: BaseState, destination_state: BaseState,
                        handler: Union[str, Callable], direction: Optional[str] = None) -> None:
 
@@ -92,12 +182,16 @@ class FSM:
 
         try:
             self._check_initialization()
+            self._check_not_frozen()
             self._transitions_keeper.add(source_state=source_state, destination_state=destination_state,
                                          handler=handler, direction=direction)
+            if self._metrics is not None:
+                self._metrics.register_transition(source_state.name, destination_state.name, handler, direction)
 
             for state in (source_state, destination_state):
                 if not self._states_mapping.check_state(state):
                     self._states_mapping.add(state.name, state)
+                self._cache_hooks_kwargs(state)
         except errors.BaseError as error:
             raise errors.TransitionAddingError(source_state=source_state, destination_state=destination_state,
                                                handler=handler, direction=direction) from error
@@ -108,8 +202,8 @@ class FSM:
     def check_transition(self, source_state: BaseState, destination_state: BaseState,
                          handler: str, direction: Optional[str] = None) -> bool:
 
-        return self._transitions_keeper.check(source_state=source_state, destination_state=destination_state,
-                                              handler=handler, direction=direction)
+        return self._transitions.check(source_state=source_state, destination_state=destination_state,
+                                       handler=handler, direction=direction)
 
     def remove_transition(self, source_state: BaseState, handler: Union[str, Callable],
                           direction: Optional[str] = None) -> None:
@@ -118,6 +212,7 @@ class FSM:
             handler = handler.__name__
 
         try:
+            self._check_not_frozen()
             destination_state = self._transitions_keeper.remove(source_state=source_state,
                                                                 handler=handler, direction=direction)
 
@@ -150,91 +245,376 @@ class FSM:
                                  process_exit: bool = True, processing_args: tuple = (),
                                  processing_kwargs: Optional[dict] = None) -> None:
 
-        if destination_state not in self._transitions_keeper.states:
+        if destination_state not in self._transitions.states:
             raise errors.StateIsNotUsedInTransitions(destination_state)
 
-        magazine = self.storage.get_magazine(chat=chat_id, user=user_id)
-        await magazine.load()
+        def resolve(magazine: Magazine) -> Tuple[BaseState, BaseState]:
+
+            return self._get_state(magazine.current_state), destination_state
 
-        source_state = self._states_mapping.get_state(magazine.current_state)
-        await self._process_transition_with_magazine(magazine, source_state=source_state,
-                                                     destination_state=destination_state,
-                                                     process_exit=process_exit,
-                                                     processing_args=processing_args,
-                                                     processing_kwargs=processing_kwargs)
+        with self._start_trace(chat_id, user_id) as trace:
+            magazine = await self._load_magazine(chat_id, user_id, trace)
+
+            source_state = self._get_state(magazine.current_state)
+            await self._process_transition_with_magazine(magazine, source_state=source_state,
+                                                         destination_state=destination_state,
+                                                         process_exit=process_exit,
+                                                         processing_args=processing_args,
+                                                         processing_kwargs=processing_kwargs,
+                                                         trace=trace, resolve=resolve)
 
     async def execute_next_transition(self, *, chat_id: int, user_id: int, handler: str,
                                       direction: Optional[str] = None, processing_args: tuple = (),
                                       processing_kwargs: Optional[dict] = None) -> None:
 
-        magazine = self.storage.get_magazine(chat=chat_id, user=user_id)
-        await magazine.load()
+        def resolve(magazine: Magazine) -> Tuple[BaseState, BaseState]:
 
-        source_state = self._states_mapping.get_state(magazine.current_state)
-        try:
-            destination_state = self._transitions_keeper.get_destination_state(source_state, handler, direction)
-        except errors.BaseError as error:
-            raise errors.NextTransitionNotFoundError(chat_id=chat_id, user_id=user_id) from error
+            source_state = self._get_state(magazine.current_state)
+            try:
+                return source_state, self._transitions.get_destination_state(source_state, handler, direction)
+            except errors.BaseError as error:
+                raise errors.NextTransitionNotFoundError(chat_id=chat_id, user_id=user_id) from error
+
+        with self._start_trace(chat_id, user_id) as trace:
+            magazine = await self._load_magazine(chat_id, user_id, trace)
 
-        await self._process_transition_with_magazine(magazine, source_state=source_state,
-                                                     destination_state=destination_state,
-                                                     processing_args=processing_args,
-                                                     processing_kwargs=processing_kwargs)
+            source_state, destination_state = resolve(magazine)
+            await self._process_transition_with_magazine(magazine, source_state=source_state,
+                                                         destination_state=destination_state,
+                                                         handler=handler, direction=direction,
+                                                         processing_args=processing_args,
+                                                         processing_kwargs=processing_kwargs,
+                                                         trace=trace, resolve=resolve)
 
     async def execute_back_transition(self, *, chat_id: int, user_id: int, processing_args: tuple = (),
                                       processing_kwargs: Optional[dict] = None) -> None:
 
-        magazine = self.storage.get_magazine(chat=chat_id, user=user_id)
-        await magazine.load()
+        def resolve(magazine: Magazine) -> Tuple[BaseState, BaseState]:
 
-        source_state = self._states_mapping.get_state(magazine.current_state)
-        try:
-            destination_state = self._states_mapping.get_state(magazine.penultimate_state)
-        except errors.BaseError as error:
-            raise errors.BackTransitionNotFoundError(chat_id=chat_id, user_id=user_id) from error
+            try:
+                return self._get_state(magazine.current_state), self._get_state(magazine.penultimate_state)
+            except errors.BaseError as error:
+                raise errors.BackTransitionNotFoundError(chat_id=chat_id, user_id=user_id) from error
+
+        with self._start_trace(chat_id, user_id) as trace:
+            magazine = await self._load_magazine(chat_id, user_id, trace)
+
+            source_state, destination_state = resolve(magazine)
+            await self._process_transition_with_magazine(magazine, source_state=source_state,
+                                                         destination_state=destination_state,
+                                                         processing_args=processing_args,
+                                                         processing_kwargs=processing_kwargs,
+                                                         trace=trace, resolve=resolve)
+
+    async def execute_transitions_bulk(self, addresses: Iterable[AddressType], *, destination_state: BaseState,
+                                       process_exit: bool = True, processing_args: tuple = (),
+                                       processing_kwargs: Optional[dict] = None, concurrency: int = 10,
+                                       batch_size: int = 100) -> Dict[AddressType, BaseException]:
+
+        if destination_state not in self._transitions.states:
+            raise errors.StateIsNotUsedInTransitions(destination_state)
+        if concurrency < 1:
+            raise ValueError("concurrency must be a positive number!")
+        if batch_size < 1:
+            raise ValueError("batch size must be a positive number!")
+
+        addresses = list(dict.fromkeys(addresses))
+        semaphore = asyncio.Semaphore(concurrency)
+        failures: Dict[AddressType, BaseException] = {}
+        for index in range(0, len(addresses), batch_size):
+            failures.update(await self._process_transitions_batch(
+                addresses[index:index + batch_size], semaphore,
+                destination_state=destination_state,
+                process_exit=process_exit,
+                processing_args=processing_args,
+                processing_kwargs=processing_kwargs or {}
+            ))
+
+        logger.info("Bulk transition to '%s' completed (%s users, %s failures)!",
+                    destination_state, len(addresses), len(failures))
+
+        return failures
+
+    async def _process_transitions_batch(self, addresses: List[AddressType], semaphore: asyncio.Semaphore, *,
+                                         destination_state: BaseState, process_exit: bool,
+                                         processing_args: tuple,
+                                         processing_kwargs: dict) -> Dict[AddressType, BaseException]:
+
+        destination_value = self._get_value(destination_state)
+        locked_addresses: List[AddressType] = []
+        changed_states: Dict[AddressType, List[Optional[str]]] = {}
+        source_states: Dict[AddressType, BaseState] = {}  # of processed users
+
+        async def lock(address: AddressType) -> None:
+
+            chat_id, user_id = address
+            async with semaphore:
+                await self._locking_storage.add(chat_id=chat_id, user_id=user_id, timeout=self._lock_timeout)
+            locked_addresses.append(address)  # the lock is held until the batch is committed
+
+        async def process(address: AddressType) -> None:
+
+            chat_id, user_id = address
+            magazine = self.storage.get_magazine(chat=chat_id, user=user_id)
+            magazine.assign(magazines_states[address])
+            source_state = self._get_state(magazine.current_state)
+            kwargs = {**processing_kwargs, "chat_id": chat_id, "user_id": user_id}
+
+            async with semaphore:
+                if process_exit:
+                    await self._process_hook(source_state, EXIT_HOOK, processing_args,
+                                             _filter_kwargs(self._get_hooks_kwargs(source_state)[0], kwargs))
+                await self._process_hook(destination_state, ENTER_HOOK, processing_args,
+                                         _filter_kwargs(self._get_hooks_kwargs(destination_state)[1], kwargs))
+
+            if source_state is not destination_state:
+                magazine.set(destination_value)
+                changed_states[address] = magazine.states
+            source_states[address] = source_state
 
-        await self._process_transition_with_magazine(magazine, source_state=source_state,
-                                                     destination_state=destination_state,
-                                                     processing_args=processing_args,
-                                                     processing_kwargs=processing_kwargs)
+        failures: Dict[AddressType, BaseException] = {}
+        try:
+            results = await asyncio.gather(*(lock(address) for address in addresses), return_exceptions=True)
+            for address, result in zip(addresses, results):
+                if isinstance(result, BaseException):
+                    failures[address] = result
+
+            # the states are read under the locks, so transitions completed before the locking are not overwritten
+            magazines_states = await self.storage.get_magazines_states(addresses)
+            for address, error in failures.items():
+                if isinstance(error, errors.TransitionLockIsActiveError):
+                    chat_id, user_id = address
+                    source_state = self._get_state(magazines_states[address][-1])
+                    if self._metrics is not None:
+                        self._metrics.record_lock_contention(source_state.name, destination_state.name)
+                    failures[address] = errors.TransitionIsLockedError(chat_id=chat_id, user_id=user_id,
+                                                                       source_state=source_state,
+                                                                       destination_state=destination_state)
+
+            results = await asyncio.gather(*(process(address) for address in locked_addresses),
+                                           return_exceptions=True)
+            for address, result in zip(locked_addresses, results):
+                if isinstance(result, BaseException):
+                    failures[address] = result
+
+            try:
+                await self.storage.set_magazines_states(changed_states)  # one round trip for the whole batch
+            except Exception as error:
+                for address in changed_states:
+                    failures[address] = error
+
+            if self._metrics is not None:
+                for address, source_state in source_states.items():
+                    if address not in failures:
+                        self._metrics.record_transition(source_state.name, destination_state.name)
+        finally:
+            await asyncio.gather(*(self._locking_storage.remove(chat_id=chat_id, user_id=user_id)
+                                   for chat_id, user_id in locked_addresses))
+
+        if failures and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Bulk transition to '%s' failed for %s of %s users!",
+                         destination_state, len(failures), len(addresses),
+                         extra={"destination_state": destination_state.name})
+
+        return failures
 
     async def _process_transition_with_magazine(self, magazine: Magazine, *, source_state: BaseState,
                                                 destination_state: BaseState, process_exit: bool = True,
+                                                handler: Optional[str] = None, direction: Optional[str] = None,
                                                 processing_args: tuple = (),
-                                                processing_kwargs: Optional[dict] = None) -> None:
+                                                processing_kwargs: Optional[dict] = None,
+                                                trace: Optional[TransitionTrace] = None,
+                                                resolve: Optional[TransitionResolverType] = None) -> None:
 
         chat_id, user_id = magazine.chat_id, magazine.user_id
+        is_debug = logger.isEnabledFor(logging.DEBUG)
+        if is_debug:
+            extra = {"chat_id": chat_id, "user_id": user_id,
+                     "source_state": source_state.name, "destination_state": destination_state.name}
+        if trace is not None:
+            trace.source_state, trace.destination_state = source_state, destination_state
 
         try:
-            async with self._locking_storage.acquire(chat_id=chat_id, user_id=user_id):
-                logger.debug(f"Started transition from '{source_state}' to '{destination_state}' "
-                             f"({chat_id=}, {user_id=})...")
+            with trace_phase(trace, LOCK_PHASE):
+                is_waited = await self._locking_storage.add(chat_id=chat_id, user_id=user_id,
+                                                            timeout=self._lock_timeout)
+        except errors.TransitionLockIsActiveError:
+            if self._metrics is not None:
+                self._metrics.record_lock_contention(source_state.name, destination_state.name)
+            raise errors.TransitionIsLockedError(chat_id=chat_id, user_id=user_id,
+                                                 source_state=source_state, destination_state=destination_state)
 
-                if processing_kwargs is None:
-                    exit_kwargs, enter_kwargs = {}, {}
-                else:
-                    exit_kwargs, enter_kwargs = [_get_spec_kwargs(method, processing_kwargs)
-                                                 for method in (source_state.process_exit,
-                                                                destination_state.process_enter)]
+        transaction = None
+        try:
+            if is_waited and (resolve is not None):  # the queued transition starts from the current state
+                with trace_phase(trace, LOAD_PHASE):
+                    magazine = await self._reload_magazine(chat_id, user_id)
+                source_state, destination_state = resolve(magazine)
+                if is_debug:
+                    extra.update(source_state=source_state.name, destination_state=destination_state.name)
+                if trace is not None:
+                    trace.source_state, trace.destination_state = source_state, destination_state
+
+            if self._transactional:  # opened under the lock, which is released if it fails
+                transaction = self.storage.begin_transaction(chat=chat_id, user=user_id)
+
+            if is_debug:
+                logger.debug("Started transition from '%s' to '%s' (chat_id=%s, user_id=%s)...",
+                             source_state, destination_state, chat_id, user_id, extra=extra)
+
+            if processing_kwargs is None:
+                exit_kwargs, enter_kwargs = {}, {}
+            else:
+                exit_kwargs = _filter_kwargs(self._get_hooks_kwargs(source_state)[0], processing_kwargs)
+                enter_kwargs = _filter_kwargs(self._get_hooks_kwargs(destination_state)[1], processing_kwargs)
+
+            if process_exit:
+                with trace_phase(trace, EXIT_PHASE):
+                    await self._process_hook(source_state, EXIT_HOOK, processing_args, exit_kwargs)
+                if is_debug:
+                    logger.debug("Produced exit from state '%s' (chat_id=%s, user_id=%s)!",
+                                 source_state, chat_id, user_id, extra=extra)
+
+            with trace_phase(trace, ENTER_PHASE):
+                await self._process_hook(destination_state, ENTER_HOOK, processing_args, enter_kwargs)
+            if is_debug:
+                logger.debug("Produced enter to state '%s' (chat_id=%s, user_id=%s)!",
+                             destination_state, chat_id, user_id, extra=extra)
+
+            if source_state is not destination_state:
+                with trace_phase(trace, COMMIT_PHASE):
+                    await magazine.push(self._get_value(destination_state))
+                    if transaction is not None:
+                        await transaction.commit()
+                if is_debug:
+                    logger.debug("State '%s' is set (chat_id=%s, user_id=%s)!",
+                                 destination_state, chat_id, user_id, extra=extra)
+            elif transaction is not None:
+                with trace_phase(trace, COMMIT_PHASE):
+                    await transaction.commit()
+        finally:
+            if transaction is not None:
+                transaction.close()  # uncommitted writes are discarded
+            await self._locking_storage.remove(chat_id=chat_id, user_id=user_id)
+
+        if self._metrics is not None:
+            self._metrics.record_transition(source_state.name, destination_state.name, handler, direction)
+
+        if is_debug:
+            logger.debug("Transition from '%s' to '%s' (chat_id=%s, user_id=%s) completed!",
+                         source_state, destination_state, chat_id, user_id, extra=extra)
+
+    async def _process_hook(self, state: BaseState, hook: str, args: tuple, kwargs: dict) -> None:
+
+        if self._metrics is None:
+            await self._call_hook_in_time(state, hook, args, kwargs)
+            return
+
+        started_at = time.perf_counter()
+        try:
+            await self._call_hook_in_time(state, hook, args, kwargs)
+        finally:
+            self._metrics.observe_hook(state.name, hook, time.perf_counter() - started_at)
 
-                if process_exit:
-                    await source_state.process_exit(*processing_args, **exit_kwargs)
-                    logger.debug(f"Produced exit from state '{source_state}' ({chat_id=}, {user_id=})!")
+    async def _call_hook_in_time(self, state: BaseState, hook: str, args: tuple, kwargs: dict) -> None:
 
-                await destination_state.process_enter(*processing_args, **enter_kwargs)
-                logger.debug(f"Produced enter to state '{destination_state}' ({chat_id=}, {user_id=})!")
+        timeout = state.hooks_timeout if state.hooks_timeout is not None else self._hooks_timeout
+        if timeout is None:
+            await self._call_hook(state, hook, args, kwargs)
+            return
 
-                if source_state is not destination_state:
-                    await magazine.push(self._states_mapping.get_value(destination_state))
-                    logger.debug(f"State '{destination_state}' is set ({chat_id=}, {user_id=})!")
+        try:
+            await asyncio.wait_for(self._call_hook(state, hook, args, kwargs), timeout)
+        except asyncio.TimeoutError:
+            if self._metrics is not None:
+                self._metrics.record_hook_timeout(state.name, hook)
+            # the lock is released and the magazine is not committed by the caller, offloaded hooks are not cancelled
+            raise errors.HookTimeoutError(state=state, hook=hook, timeout=timeout) from None
 
-        except errors.TransitionLockIsActiveError:
-            raise errors.TransitionIsLockedError(chat_id=chat_id, user_id=user_id,
-                                                 source_state=source_state, destination_state=destination_state)
+    def _call_hook(self, state: BaseState, hook: str, args: tuple, kwargs: dict) -> Awaitable:
+
+        if hook == ENTER_HOOK:
+            callback, offloading = state.process_enter, self._get_hooks_offloading(state)[1]
+        else:
+            callback, offloading = state.process_exit, self._get_hooks_offloading(state)[0]
+
+        if offloading is None:
+            return callback(*args, **kwargs)
+
+        return self.hooks_executor.run(state, callback, offloading, args, kwargs)
+
+    async def _load_magazine(self, chat_id: int, user_id: int, trace: Optional[TransitionTrace]) -> Magazine:
+
+        with trace_phase(trace, LOAD_PHASE):
+            return await self.storage.load_magazine(chat=chat_id, user=user_id)
+
+    async def _reload_magazine(self, chat_id: int, user_id: int) -> Magazine:
+
+        magazine = self.storage.get_magazine(chat=chat_id, user=user_id)  # the magazine of the update is stale
+        await magazine.load()
+        self.storage.cache_magazine(magazine)
+
+        return magazine
+
+    def _start_trace(self, chat_id: int, user_id: int) -> ContextManager[Optional[TransitionTrace]]:
 
-        logger.debug(f"Transition from '{source_state}' to '{destination_state}' ({chat_id=}, {user_id=}) completed!")
+        if self._tracer is None:
+            return NULL_CONTEXT
+
+        return self._tracer.start_trace(chat_id=chat_id, user_id=user_id)
+
+    def _cache_hooks_kwargs(self, state: BaseState) -> Tuple[AcceptedKwargsType, AcceptedKwargsType]:
+
+        hooks_kwargs = self._hooks_kwargs[state] = (_get_accepted_kwargs(state.process_exit),
+                                                    _get_accepted_kwargs(state.process_enter))
+        self._hooks_offloading[state] = (get_hook_offloading(state.process_exit),
+                                         get_hook_offloading(state.process_enter))
+
+        return hooks_kwargs
+
+    def _get_hooks_kwargs(self, state: BaseState) -> Tuple[AcceptedKwargsType, AcceptedKwargsType]:
+
+        try:
+            return self._hooks_kwargs[state]
+        except KeyError:
+            return self._cache_hooks_kwargs(state)
+
+    def _get_hooks_offloading(self, state: BaseState) -> Tuple[Optional[HookOffloading], Optional[HookOffloading]]:
+
+        try:
+            return self._hooks_offloading[state]
+        except KeyError:
+            self._cache_hooks_kwargs(state)
+            return self._hooks_offloading[state]
+
+    @property
+    def _transitions(self) -> Union[TransitionsKeeper, TransitionsTable]:
+
+        if self._transitions_table is not None:
+            return self._transitions_table
+
+        return self._transitions_keeper
+
+    def _get_state(self, value: Optional[str]) -> BaseState:
+
+        if self._transitions_table is not None:
+            return self._transitions_table.get_state(value)
+
+        return self._states_mapping.get_state(value)
+
+    def _get_value(self, state: BaseState) -> Optional[str]:
+
+        if self._transitions_table is not None:
+            return self._transitions_table.get_value(state)
+
+        return self._states_mapping.get_value(state)
 
     def _check_initialization(self):
 
         if not self.is_initialized:
             raise errors.FSMIsNotInitializedError()
+
+    def _check_not_frozen(self):
+
+        if self.is_frozen:
+            raise errors.FSMIsFrozenError()
@@ -0,0 +1,201 @@
+from bisect import bisect_left
+from typing import Optional, Dict, Tuple, List, Sequence
+
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ENTER_HOOK = "enter"
+EXIT_HOOK = "exit"
+
+TransitionKeyType = Tuple[str, str, Optional[str], Optional[str]]  # (source, destination, handler, direction)
+
+
+class Histogram:
+
+    __slots__ = ("buckets", "_counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is for +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self) -> List[int]:
+
+        counts = []
+        total = 0
+        for count in self._counts:
+            total += count
+            counts.append(total)
+
+        return counts
+
+
+def _escape_label_value(value) -> str:
+
+    if value is None:
+        return ""
+
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(**labels) -> str:
+
+    return ",".join(f"{name}=\"{_escape_label_value(value)}\"" for name, value in labels.items())
+
+
+class FSMMetrics:
+
+    """In-process FSM metrics: transitions, states occupancy, hooks latency and timeouts, lock contentions.
+
+    Counters are plain integers in dicts keyed by names of states, so recording does not allocate
+    anything but a key. Occupancy is unknown until it is seeded from the storage with FSM.count_occupancy(),
+    transitions of the current process only change the seeded values. Before the seeding, it is None in the
+    snapshot and is not exported, the transitions counters still show the flows between states.
+    """
+
+    def __init__(self, *, prefix: str = "aiogram_scenario",
+                 latency_buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+
+        self.prefix = prefix
+        self._latency_buckets = tuple(sorted(latency_buckets))
+        self._transitions: Dict[TransitionKeyType, int] = {}
+        self._occupancy: Dict[str, int] = {}
+        self._is_occupancy_seeded = False
+        self._lock_contentions: Dict[Tuple[str, str], int] = {}
+        self._hooks_latency: Dict[Tuple[str, str], Histogram] = {}
+        self._hooks_timeouts: Dict[Tuple[str, str], int] = {}
+
+    def register_state(self, state: str) -> None:
+
+        self._occupancy.setdefault(state, 0)
+        for hook in (EXIT_HOOK, ENTER_HOOK):
+            if (state, hook) not in self._hooks_latency:
+                self._hooks_latency[(state, hook)] = Histogram(self._latency_buckets)
+
+    def register_transition(self, source_state: str, destination_state: str,
+                            handler: Optional[str] = None, direction: Optional[str] = None) -> None:
+
+        self._transitions.setdefault((source_state, destination_state, handler, direction), 0)
+        self.register_state(source_state)
+        self.register_state(destination_state)
+
+    def record_transition(self, source_state: str, destination_state: str,
+                          handler: Optional[str] = None, direction: Optional[str] = None) -> None:
+
+        key = (source_state, destination_state, handler, direction)
+        self._transitions[key] = self._transitions.get(key, 0) + 1
+        if (source_state != destination_state) and self._is_occupancy_seeded:
+            # users of the initial state without stored magazines are not counted by the seeding
+            self._occupancy[source_state] = max(self._occupancy.get(source_state, 0) - 1, 0)
+            self._occupancy[destination_state] = self._occupancy.get(destination_state, 0) + 1
+
+    def record_lock_contention(self, source_state: str, destination_state: str) -> None:
+
+        key = (source_state, destination_state)
+        self._lock_contentions[key] = self._lock_contentions.get(key, 0) + 1
+
+    def observe_hook(self, state: str, hook: str, seconds: float) -> None:
+
+        histogram = self._hooks_latency.get((state, hook))
+        if histogram is None:
+            histogram = self._hooks_latency[(state, hook)] = Histogram(self._latency_buckets)
+        histogram.observe(seconds)
+
+    def record_hook_timeout(self, state: str, hook: str) -> None:
+
+        key = (state, hook)
+        self._hooks_timeouts[key] = self._hooks_timeouts.get(key, 0) + 1
+
+    @property
+    def is_occupancy_seeded(self) -> bool:
+
+        return self._is_occupancy_seeded
+
+    def set_occupancy(self, occupancy: Dict[str, int]) -> None:
+
+        for state in self._occupancy:
+            self._occupancy[state] = 0
+        self._occupancy.update(occupancy)
+        self._is_occupancy_seeded = True
+
+    def get_occupancy(self, state: str) -> Optional[int]:
+
+        if not self._is_occupancy_seeded:
+            return None
+
+        return self._occupancy.get(state, 0)
+
+    def reset(self) -> None:
+
+        # occupancy is a gauge of the current users, it is kept
+        for counters in (self._transitions, self._lock_contentions, self._hooks_timeouts):
+            for key in counters:
+                counters[key] = 0
+        for key in self._hooks_latency:
+            self._hooks_latency[key] = Histogram(self._latency_buckets)
+
+    def snapshot(self) -> dict:
+
+        return {
+            "transitions": dict(self._transitions),
+            "occupancy": dict(self._occupancy) if self._is_occupancy_seeded else None,
+            "lock_contentions": dict(self._lock_contentions),
+            "hooks_latency": {
+                key: {"count": histogram.count, "sum": histogram.sum,
+                      "buckets": dict(zip(histogram.buckets + (float("inf"),), histogram.get_cumulative_counts()))}
+                for key, histogram in self._hooks_latency.items()
+            },
+            "hooks_timeouts": dict(self._hooks_timeouts)
+        }
+
+    def export_prometheus(self) -> str:
+
+        lines = []
+
+        name = f"{self.prefix}_transitions_total"
+        lines.append(f"# HELP {name} Completed FSM transitions.")
+        lines.append(f"# TYPE {name} counter")
+        for (source_state, destination_state, handler, direction), value in self._transitions.items():
+            labels = _format_labels(source=source_state, destination=destination_state,
+                                    handler=handler, direction=direction)
+            lines.append(f"{name}{{{labels}}} {value}")
+
+        if self._is_occupancy_seeded:  # values made of transitions only are wrong, even negative
+            name = f"{self.prefix}_state_occupancy"
+            lines.append(f"# HELP {name} Users in the FSM state.")
+            lines.append(f"# TYPE {name} gauge")
+            for state, value in self._occupancy.items():
+                lines.append(f"{name}{{{_format_labels(state=state)}}} {value}")
+
+        name = f"{self.prefix}_lock_contentions_total"
+        lines.append(f"# HELP {name} Transitions rejected by the active lock.")
+        lines.append(f"# TYPE {name} counter")
+        for (source_state, destination_state), value in self._lock_contentions.items():
+            labels = _format_labels(source=source_state, destination=destination_state)
+            lines.append(f"{name}{{{labels}}} {value}")
+
+        name = f"{self.prefix}_hook_duration_seconds"
+        lines.append(f"# HELP {name} Duration of the state hooks.")
+        lines.append(f"# TYPE {name} histogram")
+        for (state, hook), histogram in self._hooks_latency.items():
+            labels = _format_labels(state=state, hook=hook)
+            bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, histogram.get_cumulative_counts()):
+                lines.append(f"{name}_bucket{{{labels},le=\"{bound}\"}} {count}")
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum!r}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        name = f"{self.prefix}_hook_timeouts_total"
+        lines.append(f"# HELP {name} State hooks not completed in the timeout.")
+        lines.append(f"# TYPE {name} counter")
+        for (state, hook), value in self._hooks_timeouts.items():
+            lines.append(f"{name}{{{_format_labels(state=state, hook=hook)}}} {value}")
+
+        return "\n".join(lines) + "\n"
@@ -2,16 +2,28 @@ from aiogram.dispatcher.middlewares import BaseMiddleware
 
 from .fsm import FSM
 from .trigger import FSMTrigger
+from .storages.base.context import open_magazines_cache, close_magazines_cache
 
 
 class FSMMiddleware(BaseMiddleware):
 
-    def __init__(self, fsm: FSM, *, trigger_kwarg: str = "fsm_trigger"):
+    def __init__(self, fsm: FSM, *, trigger_kwarg: str = "fsm_trigger", cache_magazines: bool = True):
 
         super().__init__()
         self._fsm = fsm
         self._trigger = FSMTrigger(self._fsm)
         self._trigger_kwarg = trigger_kwarg
+        self._cache_magazines = cache_magazines  # magazines are loaded from storage once per update
+
+    async def on_pre_process_update(self, *_) -> None:
+
+        if self._cache_magazines:
+            open_magazines_cache()
+
+    async def on_post_process_update(self, *_) -> None:
+
+        if self._cache_magazines:
+            close_magazines_cache()
 
     async def on_process(self, _, data: dict) -> None:
 
@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Union, Callable, Dict, List, Any
+
+from .state import BaseState
+
+
+THREAD_EXECUTOR = "thread"
+PROCESS_EXECUTOR = "process"
+
+
+class HookOffloading:
+
+    __slots__ = ("executor", "max_concurrency")
+
+    def __init__(self, executor: Union[str, Executor], max_concurrency: Optional[int]):
+
+        self.executor = executor
+        self.max_concurrency = max_concurrency  # None - limited by the executor only
+
+
+def offload(executor: Union[str, Executor] = THREAD_EXECUTOR, *, max_concurrency: Optional[int] = None):
+
+    """Marks a synchronous process_enter/process_exit of the state to be run in an executor.
+
+    The hook is run in the pool of threads or processes of HooksExecutor, or in the passed executor.
+    With the process pool, the state and the arguments of the hook must be picklable. Offloaded hooks can not
+    be cancelled: on the hooks timeout the transition fails, but the hook keeps running in the executor (and
+    holding its places in the limits) after the transition lock is released.
+    """
+
+    if isinstance(executor, str) and (executor not in (THREAD_EXECUTOR, PROCESS_EXECUTOR)):
+        raise ValueError(f"unknown executor {executor!r}!")
+    if (max_concurrency is not None) and (max_concurrency < 1):
+        raise ValueError("max concurrency must be a positive number!")
+
+    def decorator(callback: Callable) -> Callable:
+
+        if inspect.iscoroutinefunction(callback):
+            raise TypeError("only synchronous hooks can be offloaded!")
+
+        callback.__offloading__ = HookOffloading(executor, max_concurrency)
+        return callback
+
+    return decorator
+
+
+def get_hook_offloading(callback: Callable) -> Optional[HookOffloading]:
+
+    return getattr(callback, "__offloading__", None)
+
+
+class HooksExecutor:
+
+    """Runs offloaded hooks, the number of hooks waiting for the executor is limited by the queue size."""
+
+    def __init__(self, *, thread_workers: Optional[int] = None, process_workers: Optional[int] = None,
+                 max_queue_size: int = 100):
+
+        if max_queue_size < 1:
+            raise ValueError("max queue size must be a positive number!")
+
+        self._thread_workers = thread_workers
+        self._process_workers = process_workers
+        self.max_queue_size = max_queue_size
+        self._executors: Dict[Any, Executor] = {}
+        self._queues_semaphores: Dict[Any, asyncio.Semaphore] = {}  # executor key -> running and queued hooks
+        self._states_semaphores: Dict[BaseState, asyncio.Semaphore] = {}
+
+    async def run(self, state: BaseState, callback: Callable, offloading: HookOffloading, args: tuple, kwargs: dict):
+
+        if offloading.max_concurrency is None:
+            return await self._run(callback, offloading.executor, args, kwargs, None)
+
+        semaphore = self._states_semaphores.get(state)
+        if semaphore is None:
+            semaphore = self._states_semaphores[state] = asyncio.Semaphore(offloading.max_concurrency)
+        await semaphore.acquire()
+        return await self._run(callback, offloading.executor, args, kwargs, semaphore)
+
+    def shutdown(self, *, wait: bool = True) -> None:
+
+        for executor_key, executor in self._executors.items():
+            if isinstance(executor_key, str):  # passed executors are shut down by the owner
+                executor.shutdown(wait=wait)
+        self._executors.clear()
+
+    async def _run(self, callback: Callable, executor_key: Union[str, Executor], args: tuple, kwargs: dict,
+                   state_semaphore: Optional[asyncio.Semaphore]):
+
+        """Permits are released when the hook is finished in the executor, not when the caller stops waiting.
+
+        The thread or process can not be interrupted, so a hook abandoned by the timeout keeps its permits.
+        """
+
+        semaphores = [] if state_semaphore is None else [state_semaphore]
+        try:
+            executor = self._get_executor(executor_key)
+            if executor_key == PROCESS_EXECUTOR:
+                function = functools.partial(callback, *args, **kwargs)
+            else:  # context variables of aiogram (the current bot, update, etc.) are available in the thread
+                function = functools.partial(contextvars.copy_context().run, callback, *args, **kwargs)
+
+            queue_semaphore = self._queues_semaphores.get(executor_key)
+            if queue_semaphore is None:
+                queue_semaphore = asyncio.Semaphore(self._get_capacity(executor))
+                self._queues_semaphores[executor_key] = queue_semaphore
+            await queue_semaphore.acquire()
+            semaphores.append(queue_semaphore)
+
+            future = asyncio.get_running_loop().run_in_executor(executor, function)
+        except BaseException:
+            for semaphore in semaphores:
+                semaphore.release()
+            raise
+
+        future.add_done_callback(functools.partial(_release_semaphores, semaphores))
+        return await asyncio.shield(future)  # the cancellation must not complete the future before the hook
+
+    def _get_executor(self, executor_key: Union[str, Executor]) -> Executor:
+
+        if not isinstance(executor_key, str):
+            return executor_key
+
+        executor = self._executors.get(executor_key)
+        if executor is None:
+            if executor_key == THREAD_EXECUTOR:
+                executor = ThreadPoolExecutor(max_workers=self._thread_workers,
+                                              thread_name_prefix="aiogram_scenario_hooks")
+            else:
+                executor = ProcessPoolExecutor(max_workers=self._process_workers)
+            self._executors[executor_key] = executor
+
+        return executor
+
+    def _get_capacity(self, executor: Executor) -> int:
+
+        workers_number = getattr(executor, "_max_workers", 1)
+        return workers_number + self.max_queue_size
+
+
+def _release_semaphores(semaphores: List[asyncio.Semaphore], future: asyncio.Future) -> None:
+
+    if not future.cancelled():
+        future.exception()  # the error of the abandoned hook is not logged as never retrieved
+    for semaphore in semaphores:
+        semaphore.release()
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Optional, Dict, Deque, Tuple, Callable, Awaitable
+
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import Update
+
+
+logger = logging.getLogger(__name__)
+
+
+UpdateAddressType = Tuple[Optional[int], Optional[int]]  # (chat, user)
+
+
+def get_update_address(update: Update) -> Optional[UpdateAddressType]:
+
+    message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+    if message is not None:
+        user = message.from_user
+        return message.chat.id, user.id if user is not None else None
+
+    callback_query = update.callback_query
+    if callback_query is not None:
+        chat_id = callback_query.message.chat.id if callback_query.message is not None else None
+        return chat_id, callback_query.from_user.id
+
+    event = (update.inline_query or update.chosen_inline_result or update.shipping_query
+             or update.pre_checkout_query or update.poll_answer)
+    if event is not None:
+        user = getattr(event, "from_user", None) or getattr(event, "user", None)
+        if user is not None:
+            return None, user.id
+
+    return None
+
+
+class SchedulerMiddleware(BaseMiddleware):
+
+    """Processes updates of the same (chat, user) strictly in order and updates of different ones in parallel.
+
+    Updates wait for their turn in per-address queues, which exist only while the address has updates
+    in processing, and the number of concurrently processed updates is limited. An update that does not
+    fit into the full queue of its address is cancelled.
+
+    The middleware wraps the updates handler of the dispatcher instead of using pre/post hooks, which are
+    skipped when another middleware cancels the update, so the turn is always passed regardless of the order
+    of middlewares.
+    """
+
+    def __init__(self, *, max_concurrency: int = 100, max_queue_size: Optional[int] = 100):
+
+        if max_concurrency < 1:
+            raise ValueError("max concurrency must be a positive number!")
+        if (max_queue_size is not None) and (max_queue_size < 0):
+            raise ValueError("max queue size must not be negative!")
+
+        super().__init__()
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size  # None - without a limit
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # None - an update of the address is in processing, nobody waits for it
+        self._queues: Dict[UpdateAddressType, Optional[Deque[asyncio.Future]]] = {}
+        self.rejected_number = 0
+
+    @property
+    def active_addresses_number(self) -> int:
+
+        return len(self._queues)
+
+    def setup(self, manager) -> None:
+
+        super().setup(manager)
+        updates_handler = manager.dispatcher.updates_handler
+        notify = updates_handler.notify
+
+        async def notify_in_turn(update: Update, *args) -> list:
+
+            return await self.process_update(update, notify, *args)
+
+        updates_handler.notify = notify_in_turn
+
+    async def process_update(self, update: Update, notify: Callable[..., Awaitable[list]], *args) -> list:
+
+        address = get_update_address(update)
+        if address is not None:
+            try:
+                await self._wait_turn(address)
+            except CancelHandler:  # the queue is full
+                return []
+
+        try:
+            async with self._semaphore:
+                return await notify(update, *args)
+        finally:
+            if address is not None:
+                self._pass_turn(address)
+
+    async def _wait_turn(self, address: UpdateAddressType) -> None:
+
+        if address not in self._queues:
+            self._queues[address] = None
+            return
+
+        waiters = self._queues[address]
+        if waiters is None:
+            waiters = self._queues[address] = deque()
+        elif (self.max_queue_size is not None) and (len(waiters) >= self.max_queue_size):
+            self.rejected_number += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                chat_id, user_id = address
+                logger.debug("Update is rejected, the queue is full (chat_id=%s, user_id=%s)!", chat_id, user_id,
+                             extra={"chat_id": chat_id, "user_id": user_id})
+            raise CancelHandler()
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        try:
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():  # the turn is received, it is passed to the next update
+                self._pass_turn(address)
+            else:
+                waiters.remove(future)
+            raise
+
+    def _pass_turn(self, address: UpdateAddressType) -> None:
+
+        waiters = self._queues[address]
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():  # skips cancelled waiters
+                future.set_result(None)
+                return
+
+        del self._queues[address]  # the queue is idle
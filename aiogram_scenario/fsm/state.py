@@ -7,6 +7,8 @@ if TYPE_CHECKING:
 
 class BaseState:
 
+    hooks_timeout: Optional[float] = None  # None - the timeout of FSM is used
+
     def __init__(self, *, name: Optional[str] = None):
 
         self.name = name or type(self).__name__
@@ -1,4 +1,4 @@
-from typing import Dict, Optional
+from typing import Dict, Optional, ItemsView
 
 from .state import BaseState
 from aiogram_scenario import errors
@@ -19,6 +19,10 @@ class StatesMapping:
         self._values_states[value] = state
         self._states_values[state] = value
 
+    def items(self) -> ItemsView[Optional[str], BaseState]:
+
+        return self._values_states.items()
+
     def check(self, value: Optional[str], state: BaseState) -> bool:
 
         try:
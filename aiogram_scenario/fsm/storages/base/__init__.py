@@ -1,2 +1,3 @@
 from .storage import BaseStorage
 from .magazine import Magazine
+from .transaction import StorageTransaction
@@ -0,0 +1,56 @@
+from __future__ import annotations
+from contextvars import ContextVar
+from typing import Dict, Tuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .storage import BaseStorage
+    from .magazine import Magazine
+    from .transaction import StorageTransaction
+
+
+MagazinesCacheType = Dict[Tuple["BaseStorage", int, int], "Magazine"]
+TransactionsType = Dict[Tuple["BaseStorage", int, int], "StorageTransaction"]
+
+_magazines_cache: ContextVar[Optional[MagazinesCacheType]] = ContextVar("aiogram_scenario_magazines_cache",
+                                                                       default=None)
+_transactions: ContextVar[Optional[TransactionsType]] = ContextVar("aiogram_scenario_transactions", default=None)
+
+
+def open_magazines_cache() -> None:
+
+    _magazines_cache.set({})
+
+
+def close_magazines_cache() -> None:
+
+    _magazines_cache.set(None)
+
+
+def get_magazines_cache() -> Optional[MagazinesCacheType]:
+
+    return _magazines_cache.get()
+
+
+def get_transaction(storage: BaseStorage, chat: int, user: int) -> Optional[StorageTransaction]:
+
+    transactions = _transactions.get()
+    if transactions is None:
+        return None
+
+    transaction = transactions.get((storage, chat, user))
+    if (transaction is not None) and transaction.is_closed:  # the context is copied by a task of the transaction
+        return None
+
+    return transaction
+
+
+def add_transaction(transaction: StorageTransaction) -> None:
+
+    transactions = _transactions.get() or {}  # the dict is not changed in place, it may be shared with other tasks
+    _transactions.set({**transactions, (transaction.storage, transaction.chat_id, transaction.user_id): transaction})
+
+
+def remove_transaction(transaction: StorageTransaction) -> None:
+
+    transactions = _transactions.get() or {}
+    _transactions.set({key: value for key, value in transactions.items() if value is not transaction} or None)
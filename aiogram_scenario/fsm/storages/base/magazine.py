@@ -1,25 +1,37 @@
 from __future__ import annotations
-from typing import List, Optional, TYPE_CHECKING
+from collections import deque
+from typing import List, Optional, Dict, Deque, AsyncContextManager, TYPE_CHECKING
 import logging
 
 from aiogram_scenario import errors
 if TYPE_CHECKING:
     from .storage import BaseStorage
+    from .transaction import StorageTransaction
 
 
 logger = logging.getLogger(__name__)
 
 
+def trim_states(states: List[Optional[str]], depth: Optional[int]) -> List[Optional[str]]:
+
+    if depth is None:
+        return list(states)
+
+    return states[-depth:]
+
+
 class Magazine:
 
-    __slots__ = ("user_id", "chat_id", "_storage", "_states")
+    __slots__ = ("user_id", "chat_id", "_storage", "_states", "_positions", "_offset")
 
     def __init__(self, storage: BaseStorage, *, chat_id: int, user_id: int):
 
         self.chat_id = chat_id
         self.user_id = user_id
         self._storage = storage
-        self._states: Optional[list] = None
+        self._states: Optional[Deque[Optional[str]]] = None
+        self._positions: Dict[Optional[str], int] = {}  # state -> absolute position
+        self._offset = 0  # absolute position of the first state
 
     def __str__(self):
 
@@ -33,32 +45,46 @@ class Magazine:
 
     async def load(self) -> None:
 
-        self._states = await self._storage.get_magazine_states(chat=self.chat_id, user=self.user_id)
+        states = await self._storage.get_magazine_states(chat=self.chat_id, user=self.user_id)
+        self.assign(states)
 
-        logger.debug(f"States loaded into the magazine: {self._states}, "
-                     f"(chat_id={self.chat_id}, user_id={self.user_id})!")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("States loaded into the magazine: %s (chat_id=%s, user_id=%s)!",
+                         self.states, self.chat_id, self.user_id, extra=self._get_log_extra())
+
+    def assign(self, states: List[Optional[str]]) -> None:
+
+        self._states = deque()
+        self._positions = {}
+        self._offset = 0
+        for state in states:  # normalizes data stored without deduplication or with another depth
+            self._set(state)
 
     def set(self, state) -> None:
 
-        try:
-            state_index = self.states.index(state)
-        except ValueError:  # not on the magazine
-            self._states.append(state)
-        else:  # exists on the magazine
-            del self._states[state_index + 1:]
+        self._check_loading()
+        self._set(state)
 
-        logger.debug(f"Magazine set state: {state!r} (chat_id={self.chat_id}, user_id={self.user_id})!")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Magazine set state: %r (chat_id=%s, user_id=%s)!",
+                         state, self.chat_id, self.user_id, extra=self._get_log_extra())
 
     async def commit(self) -> None:
 
-        await self._storage.set_magazine_states(chat=self.chat_id, user=self.user_id, states=self._states)
-        logger.debug(f"Magazine has committed states {self._states} to storage "
-                     f"(chat_id={self.chat_id}, user_id={self.user_id})!")
+        await self._storage.set_magazine_states(chat=self.chat_id, user=self.user_id, states=self.states)
+        self._storage.cache_magazine(self)  # the committed magazine is up to date
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Magazine has committed states %s to storage (chat_id=%s, user_id=%s)!",
+                         self.states, self.chat_id, self.user_id, extra=self._get_log_extra())
 
     async def push(self, state) -> None:
 
-        self.set(state)
-        await self.commit()
+        self._check_loading()
+        await self._storage.push_magazine_state(self, state)
+
+    def transaction(self) -> AsyncContextManager[StorageTransaction]:
+
+        return self._storage.transaction(chat=self.chat_id, user=self.user_id)
 
     async def reset(self) -> None:
 
@@ -69,26 +95,52 @@ class Magazine:
 
         return self._states is not None
 
+    @property
+    def depth(self) -> Optional[int]:
+
+        return self._storage.magazine_depth
+
     @property
     def states(self) -> List[Optional[str]]:
 
         self._check_loading()
-        return self._states
+        return list(self._states)
 
     @property
     def current_state(self) -> Optional[str]:
 
-        return self.states[-1]
+        self._check_loading()
+        return self._states[-1]
 
     @property
     def penultimate_state(self) -> Optional[str]:
 
+        self._check_loading()
         try:
-            return self.states[-2]
+            return self._states[-2]
         except IndexError:
             raise errors.PenultimateStateNotFoundInMagazineError(chat_id=self.chat_id, user_id=self.user_id,
                                                                  states=self.states)
 
+    def _set(self, state) -> None:
+
+        position = self._positions.get(state)
+        if position is None:  # not on the magazine
+            self._positions[state] = self._offset + len(self._states)
+            self._states.append(state)
+
+            depth = self.depth
+            if (depth is not None) and (len(self._states) > depth):
+                del self._positions[self._states.popleft()]
+                self._offset += 1
+        else:  # exists on the magazine
+            for _ in range(len(self._states) - (position - self._offset) - 1):
+                del self._positions[self._states.pop()]
+
+    def _get_log_extra(self) -> dict:
+
+        return {"chat_id": self.chat_id, "user_id": self.user_id, "states": self.states}
+
     def _check_loading(self):
 
         if not self.is_loaded:
@@ -1,26 +1,355 @@
+import copy
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Tuple, Union, Iterable, AsyncIterator
 
 import aiogram
 
-from .magazine import Magazine
+from .magazine import Magazine, trim_states
+from .context import get_magazines_cache, get_transaction
+from .transaction import StorageTransaction
+from .write_behind import MagazinesWriteBehind
+from aiogram_scenario.fsm.storages.codecs import CompactStatesCodec
+from aiogram_scenario import errors
+
+
+MagazinePayloadType = Union[List[Optional[str]], bytes]  # bytes - states encoded by the codec
+AddressType = Tuple[int, int]  # (chat, user)
 
 
 class BaseStorage(aiogram.dispatcher.storage.BaseStorage, ABC):
 
-    @abstractmethod
+    _magazine_depth: Optional[int] = None
+    _write_behind: Optional[MagazinesWriteBehind] = None
+    states_codec: Optional[CompactStatesCodec] = None
+
+    def __init__(self, *args, magazine_depth: Optional[int] = None,
+                 states_codec: Optional[CompactStatesCodec] = None, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self.magazine_depth = magazine_depth
+        self.states_codec = states_codec
+
+    @property
+    def magazine_depth(self) -> Optional[int]:
+
+        return self._magazine_depth
+
+    @magazine_depth.setter
+    def magazine_depth(self, depth: Optional[int]) -> None:
+
+        if (depth is not None) and (depth < 1):
+            raise ValueError("magazine depth must be a positive number!")
+
+        self._magazine_depth = depth
+
+    @property
+    def is_write_behind(self) -> bool:
+
+        return self._write_behind is not None
+
+    def enable_write_behind(self, *, max_size: int = 100, interval: float = 0.1) -> None:
+
+        self._write_behind = MagazinesWriteBehind(self._set_magazines_states, max_size=max_size, interval=interval)
+
+    async def flush(self) -> None:
+
+        if self._write_behind is not None:
+            await self._write_behind.flush()
+
+    async def close(self) -> None:
+
+        await self.flush()
+        await super().close()
+
     async def set_magazine_states(self, *, chat: Optional[int] = None, user: Optional[int] = None,
                                   states: List[Optional[str]]) -> None:
 
-        pass
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:  # it is written on the commit
+            transaction.magazine_states = trim_states(states, self._magazine_depth)
+        else:
+            payload = self._encode_magazine_payload(trim_states(states, self._magazine_depth))
+            if self._write_behind is not None:
+                self._write_behind.put(chat, user, payload)
+            else:
+                await self._set_magazine_states(chat, user, payload)
+
+        cache = get_magazines_cache()
+        if cache is not None:
+            cache.pop((self, chat, user), None)
 
-    @abstractmethod
     async def get_magazine_states(self, *, chat: Optional[int] = None,
                                   user: Optional[int] = None) -> List[Optional[str]]:
 
-        pass
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if (transaction is not None) and (transaction.magazine_states is not None):
+            return list(transaction.magazine_states)
+
+        payload = None
+        if self._write_behind is not None:
+            payload = self._write_behind.get(chat, user)
+        if payload is None:
+            payload = await self._get_magazine_states(chat, user)
+
+        return self._decode_magazine_payload(payload)
+
+    async def set_magazines_states(self, states: Dict[AddressType, List[Optional[str]]]) -> None:
+
+        payloads = {address: self._encode_magazine_payload(trim_states(address_states, self._magazine_depth))
+                    for address, address_states in states.items()}
+        if not payloads:
+            return
+
+        if self._write_behind is not None:
+            for (chat, user), payload in payloads.items():
+                self._write_behind.put(chat, user, payload)
+        else:
+            await self._set_magazines_states(payloads)
+
+        cache = get_magazines_cache()
+        if cache is not None:
+            for chat, user in payloads:
+                cache.pop((self, chat, user), None)
+
+    async def get_magazines_states(self, addresses: Iterable[AddressType]) -> Dict[AddressType, List[Optional[str]]]:
+
+        addresses = list(dict.fromkeys(addresses))  # without duplicates, in the original order
+        payloads: Dict[AddressType, MagazinePayloadType] = {}
+        if self._write_behind is not None:
+            for chat, user in addresses:
+                payload = self._write_behind.get(chat, user)
+                if payload is not None:
+                    payloads[(chat, user)] = payload
+
+        missing_addresses = [address for address in addresses if address not in payloads]
+        if missing_addresses:
+            payloads.update(await self._get_magazines_states(missing_addresses))
+
+        return {address: self._decode_magazine_payload(payloads[address]) for address in addresses}
+
+    async def iter_magazines(self, *, batch_size: int = 1000) -> AsyncIterator[Tuple[int, int, List[Optional[str]]]]:
+
+        if batch_size < 1:
+            raise ValueError("batch size must be a positive number!")
+
+        await self.flush()  # pending states must be visible to the iteration
+        async for chat, user, payload in self._iter_magazines(batch_size):
+            yield chat, user, self._decode_magazine_payload(payload)
+
+    async def get_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                       default: Optional[dict] = None) -> Dict:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if (transaction is not None) and (transaction.data is not None):
+            return copy.deepcopy(transaction.data or default or {})
+
+        return await self._get_data(chat, user, default)
+
+    async def set_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                       data: Dict = None):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:
+            transaction.data = copy.deepcopy(data or {})
+        else:
+            await self._set_data(chat, user, data)
+
+    async def update_data(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                          data: Dict = None, **kwargs):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:
+            if transaction.data is None:
+                transaction.data = await self._get_data(chat, user, None)
+            transaction.data.update(copy.deepcopy({**(data or {}), **kwargs}))
+        else:
+            await self._update_data(chat, user, {**(data or {}), **kwargs})
+
+    async def get_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                         default: Optional[dict] = None) -> Dict:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if (transaction is not None) and (transaction.bucket is not None):
+            return copy.deepcopy(transaction.bucket or default or {})
+
+        return await self._get_bucket(chat, user, default)
+
+    async def set_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                         bucket: Dict = None):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:
+            transaction.bucket = copy.deepcopy(bucket or {})
+        else:
+            await self._set_bucket(chat, user, bucket)
+
+    async def update_bucket(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                            bucket: Dict = None, **kwargs):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:
+            if transaction.bucket is None:
+                transaction.bucket = await self._get_bucket(chat, user, None)
+            transaction.bucket.update(copy.deepcopy({**(bucket or {}), **kwargs}))
+        else:
+            await self._update_bucket(chat, user, {**(bucket or {}), **kwargs})
+
+    def begin_transaction(self, *, chat: Optional[int] = None, user: Optional[int] = None) -> StorageTransaction:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        if get_transaction(self, chat, user) is not None:
+            raise errors.StorageTransactionIsActiveError(chat_id=chat, user_id=user)
+
+        return StorageTransaction(self, chat_id=chat, user_id=user)
+
+    @asynccontextmanager
+    async def transaction(self, *, chat: Optional[int] = None,
+                          user: Optional[int] = None) -> AsyncIterator[StorageTransaction]:
+
+        transaction = self.begin_transaction(chat=chat, user=user)
+        try:
+            yield transaction
+            if not transaction.is_closed:
+                await transaction.commit()
+        finally:
+            transaction.close()
+
+    async def commit_transaction(self, transaction: StorageTransaction) -> None:
+
+        payload = None
+        if transaction.magazine_states is not None:
+            payload = self._encode_magazine_payload(transaction.magazine_states)
+
+        if (self._write_behind is not None) and (payload is not None):
+            if (transaction.data is not None) or (transaction.bucket is not None):
+                await self._commit_transaction(transaction.chat_id, transaction.user_id, None,
+                                               transaction.data, transaction.bucket)
+            self._write_behind.put(transaction.chat_id, transaction.user_id, payload)
+        else:
+            await self._commit_transaction(transaction.chat_id, transaction.user_id, payload,
+                                           transaction.data, transaction.bucket)
+
+    async def push_magazine_state(self, magazine: Magazine, state: Optional[str]) -> None:
+
+        magazine.set(state)
+        try:
+            await magazine.commit()
+        except BaseException:
+            self.uncache_magazine(magazine)  # the magazine contains an uncommitted state
+            raise
 
     def get_magazine(self, *, chat: Optional[int] = None, user: Optional[int] = None) -> Magazine:
 
         chat_id, user_id = self.check_address(chat=chat, user=user)
         return Magazine(self, chat_id=chat_id, user_id=user_id)
+
+    async def load_magazine(self, *, chat: Optional[int] = None, user: Optional[int] = None) -> Magazine:
+
+        chat_id, user_id = self.check_address(chat=chat, user=user)
+        cache = get_magazines_cache()
+        if cache is not None:
+            try:
+                return cache[(self, chat_id, user_id)]
+            except KeyError:
+                pass
+
+        magazine = Magazine(self, chat_id=chat_id, user_id=user_id)
+        await magazine.load()
+        if cache is not None:
+            cache[(self, chat_id, user_id)] = magazine
+
+        return magazine
+
+    def cache_magazine(self, magazine: Magazine) -> None:
+
+        cache = get_magazines_cache()
+        if cache is not None:
+            cache[(self, magazine.chat_id, magazine.user_id)] = magazine
+
+    def uncache_magazine(self, magazine: Magazine) -> None:
+
+        cache = get_magazines_cache()
+        if cache is not None:
+            cache.pop((self, magazine.chat_id, magazine.user_id), None)
+
+    def _encode_magazine_payload(self, states: List[Optional[str]]) -> MagazinePayloadType:
+
+        if self.states_codec is None:
+            return states
+
+        return self.states_codec.encode(states)
+
+    def _decode_magazine_payload(self, payload: MagazinePayloadType) -> List[Optional[str]]:
+
+        if not isinstance(payload, bytes):
+            return list(payload)
+        elif self.states_codec is None:
+            raise errors.MagazinePayloadDecodingError(payload)
+
+        return self.states_codec.decode(payload)
+
+    @abstractmethod
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
+
+        pass
+
+    @abstractmethod
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
+
+        pass
+
+    async def _commit_transaction(self, chat: int, user: int, payload: Optional[MagazinePayloadType],
+                                  data: Optional[dict], bucket: Optional[dict]) -> None:
+
+        if payload is not None:
+            await self._set_magazine_states(chat, user, payload)
+        if data is not None:
+            await self._set_data(chat, user, data)
+        if bucket is not None:
+            await self._set_bucket(chat, user, bucket)
+
+    async def _get_data(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        return await super().get_data(chat=chat, user=user, default=default)
+
+    async def _set_data(self, chat: int, user: int, data: Optional[Dict]) -> None:
+
+        await super().set_data(chat=chat, user=user, data=data)
+
+    async def _update_data(self, chat: int, user: int, data: Dict) -> None:
+
+        await super().update_data(chat=chat, user=user, data=data)
+
+    async def _get_bucket(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        return await super().get_bucket(chat=chat, user=user, default=default)
+
+    async def _set_bucket(self, chat: int, user: int, bucket: Optional[Dict]) -> None:
+
+        await super().set_bucket(chat=chat, user=user, bucket=bucket)
+
+    async def _update_bucket(self, chat: int, user: int, bucket: Dict) -> None:
+
+        await super().update_bucket(chat=chat, user=user, bucket=bucket)
+
+    async def _set_magazines_states(self, payloads: Dict[AddressType, MagazinePayloadType]) -> None:
+
+        for (chat, user), payload in payloads.items():
+            await self._set_magazine_states(chat, user, payload)
+
+    async def _get_magazines_states(self, addresses: List[AddressType]) -> Dict[AddressType, MagazinePayloadType]:
+
+        return {(chat, user): await self._get_magazine_states(chat, user) for chat, user in addresses}
+
+    def _iter_magazines(self, batch_size: int) -> AsyncIterator[Tuple[int, int, MagazinePayloadType]]:
+
+        raise NotImplementedError(f"{type(self).__name__} does not support iteration over magazines!")
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import List, Optional, TYPE_CHECKING
+import logging
+
+from .context import add_transaction, remove_transaction, get_magazines_cache
+if TYPE_CHECKING:
+    from .storage import BaseStorage
+
+
+logger = logging.getLogger(__name__)
+
+
+class StorageTransaction:
+
+    """Buffers writes of the magazine, data and bucket of one user until the commit.
+
+    While the transaction is open, the storage keeps writes to its address made in the same context here,
+    and reads return them. The commit writes them in one batch, closing without the commit discards them.
+    The batch is atomic unless the backend has no transactions: MongoDB on a standalone server writes the
+    magazine, data and bucket separately, so a failed commit may leave some of them written.
+    """
+
+    __slots__ = ("storage", "chat_id", "user_id", "magazine_states", "data", "bucket", "_is_committed", "_is_closed")
+
+    def __init__(self, storage: BaseStorage, *, chat_id: int, user_id: int):
+
+        self.storage = storage
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.magazine_states: Optional[List[Optional[str]]] = None  # None - it is not written
+        self.data: Optional[dict] = None
+        self.bucket: Optional[dict] = None
+        self._is_committed = False
+        self._is_closed = False
+        add_transaction(self)
+
+    @property
+    def is_changed(self) -> bool:
+
+        return (self.magazine_states is not None) or (self.data is not None) or (self.bucket is not None)
+
+    @property
+    def is_committed(self) -> bool:
+
+        return self._is_committed
+
+    @property
+    def is_closed(self) -> bool:
+
+        return self._is_closed
+
+    async def commit(self) -> None:
+
+        if self._is_closed:
+            raise RuntimeError("transaction is closed!")
+
+        remove_transaction(self)  # the storage writes to the backend from now
+        if self.is_changed:
+            await self.storage.commit_transaction(self)
+        self._is_committed = True
+        self.close()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Transaction is committed (chat_id=%s, user_id=%s)!", self.chat_id, self.user_id,
+                         extra={"chat_id": self.chat_id, "user_id": self.user_id})
+
+    def close(self) -> None:
+
+        if self._is_closed:
+            return
+
+        self._is_closed = True
+        remove_transaction(self)
+        if self._is_committed:
+            return
+
+        if self.magazine_states is not None:  # the cached magazine contains the discarded state
+            cache = get_magazines_cache()
+            if cache is not None:
+                cache.pop((self.storage, self.chat_id, self.user_id), None)
+
+        if logger.isEnabledFor(logging.DEBUG) and self.is_changed:
+            logger.debug("Transaction is discarded (chat_id=%s, user_id=%s)!", self.chat_id, self.user_id,
+                         extra={"chat_id": self.chat_id, "user_id": self.user_id})
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Optional, Callable, Awaitable, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+MagazinesPayloadsType = Dict[Tuple[int, int], Union[List[Optional[str]], bytes]]
+
+
+class MagazinesWriteBehind:
+
+    def __init__(self, flush_callback: Callable[[MagazinesPayloadsType], Awaitable[None]], *,
+                 max_size: int = 100, interval: float = 0.1):
+
+        self._flush_callback = flush_callback
+        self._max_size = max_size
+        self._interval = interval
+        self._pending: MagazinesPayloadsType = {}
+        self._flushing: MagazinesPayloadsType = {}  # is being written right now, still visible for reading
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+
+        return len(self._pending) + len(self._flushing)
+
+    def put(self, chat: int, user: int, payload: Union[List[Optional[str]], bytes]) -> None:
+
+        self._pending[(chat, user)] = payload
+
+        if len(self._pending) >= self._max_size:
+            self._start_flushing()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._interval, self._start_flushing)
+
+    def get(self, chat: int, user: int) -> Optional[Union[List[Optional[str]], bytes]]:
+
+        key = (chat, user)
+        payload = self._pending.get(key)
+        if payload is None:
+            payload = self._flushing.get(key)
+
+        return payload
+
+    async def flush(self) -> None:
+
+        async with self._lock:
+            self._cancel_timer()
+            if not self._pending:
+                return
+
+            self._flushing, self._pending = self._pending, {}
+            try:
+                await self._flush_callback(self._flushing)
+            except BaseException:
+                for key, payload in self._flushing.items():  # newer payloads are not overwritten
+                    self._pending.setdefault(key, payload)
+                raise
+            finally:
+                self._flushing = {}
+
+        logger.debug("Write-behind buffer is flushed!")
+
+    def _start_flushing(self) -> None:
+
+        self._cancel_timer()
+        if (self._task is None) or self._task.done():
+            self._task = asyncio.ensure_future(self._flush_in_background())
+
+    async def _flush_in_background(self) -> None:
+
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush the write-behind buffer, it will be retried!")
+
+        if self._pending and (self._timer is None):
+            self._timer = asyncio.get_running_loop().call_later(self._interval, self._start_flushing)
+
+    def _cancel_timer(self) -> None:
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -0,0 +1,373 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from typing import Union, Optional, AnyStr, Dict, List, Tuple, Iterable, AsyncIterator, TYPE_CHECKING
+
+from .base import BaseStorage, Magazine, StorageTransaction
+from .base.magazine import trim_states
+from .base.context import get_magazines_cache, get_transaction
+from .base.storage import MagazinePayloadType, AddressType
+if TYPE_CHECKING:
+    from .redis import RedisStorage
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachingStorage(BaseStorage):
+
+    """Keeps recently used magazines of the wrapped storage in a bounded LRU with TTL.
+
+    The wrapped storage stays authoritative: magazines are written through it, and with the invalidation
+    channel other workers drop their cached copies of changed magazines over Redis pub/sub. Each write and
+    invalidation changes the generation of the address, so results of reads and writes which were in progress
+    meanwhile are not cached.
+    """
+
+    def __init__(self, storage: BaseStorage, *, max_size: int = 10000, ttl: Optional[float] = 60.0,
+                 invalidation_channel: Optional[str] = None, invalidation_storage: Optional["RedisStorage"] = None):
+
+        if max_size < 1:
+            raise ValueError("max size must be a positive number!")
+        if (invalidation_channel is not None) and (invalidation_storage is None):
+            if not hasattr(storage, "redis"):
+                raise ValueError("invalidation channel requires the Redis storage!")
+            invalidation_storage = storage
+
+        super().__init__()
+        self._storage = storage
+        self._max_size = max_size
+        self._ttl = ttl  # None - entries are removed only by size or invalidation
+        self._entries: "OrderedDict[AddressType, Tuple[float, List[Optional[str]]]]" = OrderedDict()
+        self._generations: Dict[AddressType, int] = {}  # of addresses with loadings in progress only
+        self._loadings_numbers: Dict[AddressType, int] = {}
+        self._invalidation_channel = invalidation_channel
+        self._invalidation_storage = invalidation_storage
+        self._invalidation_task: Optional[asyncio.Task] = None
+        self._instance_id = secrets.token_hex(8)  # own invalidations are skipped
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def storage(self) -> BaseStorage:
+
+        return self._storage
+
+    @property
+    def magazine_depth(self) -> Optional[int]:
+
+        return self._storage.magazine_depth
+
+    @magazine_depth.setter
+    def magazine_depth(self, depth: Optional[int]) -> None:
+
+        if depth is not None:  # it is not passed to the wrapper
+            self._storage.magazine_depth = depth
+
+    @property
+    def is_write_behind(self) -> bool:
+
+        return self._storage.is_write_behind
+
+    def enable_write_behind(self, *, max_size: int = 100, interval: float = 0.1) -> None:
+
+        self._storage.enable_write_behind(max_size=max_size, interval=interval)
+
+    async def flush(self) -> None:
+
+        await self._storage.flush()
+
+    async def close(self) -> None:
+
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            self._invalidation_task = None
+        self.clear()
+        await self._storage.close()
+
+    async def wait_closed(self) -> None:
+
+        await self._storage.wait_closed()
+
+    def clear(self) -> None:
+
+        self._entries.clear()
+        for address in self._generations:
+            self._generations[address] += 1
+
+    async def set_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        state: Optional[AnyStr] = None):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
+        await magazine.push(state)
+
+    async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
+        return magazine.current_state
+
+    async def set_magazine_states(self, *, chat: Optional[int] = None, user: Optional[int] = None,
+                                  states: List[Optional[str]]) -> None:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if transaction is not None:  # it is written through on the commit
+            transaction.magazine_states = trim_states(states, self.magazine_depth)
+            self._uncache_magazines([(chat, user)])
+            return
+
+        self._invalidate((chat, user))  # the entry is stale while writing
+        generation = self._start_loading((chat, user))
+        written_states = None
+        try:
+            await self._storage.set_magazine_states(chat=chat, user=user, states=states)
+            written_states = trim_states(states, self.magazine_depth)
+        finally:
+            self._finish_loading((chat, user), generation, written_states, is_write=True)
+        self._uncache_magazines([(chat, user)])
+        await self._publish_invalidation([(chat, user)])
+
+    async def get_magazine_states(self, *, chat: Optional[int] = None,
+                                  user: Optional[int] = None) -> List[Optional[str]]:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        transaction = get_transaction(self, chat, user)
+        if (transaction is not None) and (transaction.magazine_states is not None):
+            return list(transaction.magazine_states)
+
+        states = self._get((chat, user))
+        if states is None:
+            generation = self._start_loading((chat, user))
+            try:
+                states = await self._storage.get_magazine_states(chat=chat, user=user)
+            finally:
+                self._finish_loading((chat, user), generation, states)
+
+        return list(states)
+
+    async def set_magazines_states(self, states: Dict[AddressType, List[Optional[str]]]) -> None:
+
+        addresses = list(states)
+        for address in addresses:
+            self._invalidate(address)
+        generations = [self._start_loading(address) for address in addresses]
+        try:
+            await self._storage.set_magazines_states(states)
+        finally:
+            for address, generation in zip(addresses, generations):
+                self._finish_loading(address, generation, None, is_write=True)
+        self._uncache_magazines(addresses)
+        await self._publish_invalidation(addresses)
+
+    async def get_magazines_states(self, addresses: Iterable[AddressType]) -> Dict[AddressType, List[Optional[str]]]:
+
+        addresses = list(dict.fromkeys(addresses))
+        result = {}
+        missing_addresses = []
+        for address in addresses:
+            states = self._get(address)
+            if states is None:
+                missing_addresses.append(address)
+            else:
+                result[address] = list(states)
+
+        if missing_addresses:
+            generations = [self._start_loading(address) for address in missing_addresses]
+            loaded_states = {}
+            try:
+                loaded_states = await self._storage.get_magazines_states(missing_addresses)
+            finally:
+                for address, generation in zip(missing_addresses, generations):
+                    self._finish_loading(address, generation, loaded_states.get(address))
+            for address, states in loaded_states.items():
+                result[address] = list(states)
+
+        return {address: result[address] for address in addresses}
+
+    async def iter_magazines(self, *, batch_size: int = 1000) -> AsyncIterator[Tuple[int, int, List[Optional[str]]]]:
+
+        async for chat, user, states in self._storage.iter_magazines(batch_size=batch_size):
+            yield chat, user, states
+
+    async def push_magazine_state(self, magazine: Magazine, state: Optional[str]) -> None:
+
+        if get_transaction(self, magazine.chat_id, magazine.user_id) is not None:
+            await super().push_magazine_state(magazine, state)  # it is buffered by set_magazine_states
+            return
+
+        address = (magazine.chat_id, magazine.user_id)
+        self._invalidate(address)
+        generation = self._start_loading(address)
+        written_states = None
+        # the wrapped storage commits its own magazine, so the write does not come back through this storage
+        wrapped_magazine = self._storage.get_magazine(chat=magazine.chat_id, user=magazine.user_id)
+        wrapped_magazine.assign(magazine.states)
+        try:
+            await self._storage.push_magazine_state(wrapped_magazine, state)
+            written_states = wrapped_magazine.states
+            magazine.assign(written_states)
+        except BaseException:
+            self.uncache_magazine(magazine)  # the magazine may be changed by another worker
+            raise
+        finally:
+            self._finish_loading(address, generation, written_states, is_write=True)
+
+        await self._publish_invalidation([address])
+
+    async def commit_transaction(self, transaction: StorageTransaction) -> None:
+
+        if transaction.magazine_states is None:
+            await self._storage.commit_transaction(transaction)
+            return
+
+        address = (transaction.chat_id, transaction.user_id)
+        self._invalidate(address)
+        generation = self._start_loading(address)
+        written_states = None
+        try:
+            await self._storage.commit_transaction(transaction)
+            written_states = transaction.magazine_states
+        finally:
+            self._finish_loading(address, generation, written_states, is_write=True)
+
+        await self._publish_invalidation([address])
+
+    def has_bucket(self):
+
+        return self._storage.has_bucket()
+
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
+
+        await self._storage._set_magazine_states(chat, user, payload)
+
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
+
+        return await self._storage._get_magazine_states(chat, user)
+
+    async def _get_data(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        return await self._storage.get_data(chat=chat, user=user, default=default)
+
+    async def _set_data(self, chat: int, user: int, data: Optional[Dict]) -> None:
+
+        await self._storage.set_data(chat=chat, user=user, data=data)
+
+    async def _update_data(self, chat: int, user: int, data: Dict) -> None:
+
+        await self._storage.update_data(chat=chat, user=user, data=data)
+
+    async def _get_bucket(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        return await self._storage.get_bucket(chat=chat, user=user, default=default)
+
+    async def _set_bucket(self, chat: int, user: int, bucket: Optional[Dict]) -> None:
+
+        await self._storage.set_bucket(chat=chat, user=user, bucket=bucket)
+
+    async def _update_bucket(self, chat: int, user: int, bucket: Dict) -> None:
+
+        await self._storage.update_bucket(chat=chat, user=user, bucket=bucket)
+
+    def _uncache_magazines(self, addresses: List[AddressType]) -> None:
+
+        cache = get_magazines_cache()
+        if cache is not None:
+            for chat, user in addresses:
+                cache.pop((self, chat, user), None)
+
+    def _get(self, address: AddressType) -> Optional[List[Optional[str]]]:
+
+        self._start_invalidation()
+        entry = self._entries.get(address)
+        if entry is not None:
+            expires_at, states = entry
+            if (expires_at is None) or (expires_at > time.monotonic()):
+                self._entries.move_to_end(address)
+                self.hits += 1
+                return states
+            del self._entries[address]
+
+        self.misses += 1
+        return None
+
+    def _put(self, address: AddressType, states: List[Optional[str]]) -> None:
+
+        expires_at = None if self._ttl is None else time.monotonic() + self._ttl
+        self._entries[address] = (expires_at, list(states))
+        self._entries.move_to_end(address)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _invalidate(self, address: AddressType) -> None:
+
+        self._entries.pop(address, None)
+        if address in self._generations:  # states loaded in progress are outdated
+            self._generations[address] += 1
+
+    def _start_loading(self, address: AddressType) -> int:
+
+        self._loadings_numbers[address] = self._loadings_numbers.get(address, 0) + 1
+        return self._generations.setdefault(address, 0)
+
+    def _finish_loading(self, address: AddressType, generation: int, states: Optional[List[Optional[str]]], *,
+                        is_write: bool = False) -> None:
+
+        """Caches the loaded or written states, unless the address is changed or invalidated meanwhile."""
+
+        is_actual = self._generations[address] == generation
+        if is_write:  # reads started during the write may return the previous states
+            self._generations[address] += 1
+        if (states is not None) and is_actual:
+            self._put(address, states)
+
+        self._loadings_numbers[address] -= 1
+        if not self._loadings_numbers[address]:
+            del self._loadings_numbers[address]
+            del self._generations[address]
+
+    def _start_invalidation(self) -> None:
+
+        if (self._invalidation_channel is not None) and (self._invalidation_task is None):
+            self._invalidation_task = asyncio.get_running_loop().create_task(self._listen_invalidations())
+
+    async def _publish_invalidation(self, addresses: List[AddressType]) -> None:
+
+        if self._invalidation_channel is None:
+            return
+
+        self._start_invalidation()
+        message = self._instance_id + " " + ",".join(f"{chat}:{user}" for chat, user in addresses)
+        redis_ = await self._invalidation_storage.redis()
+        await redis_.publish(self._invalidation_channel, message)
+
+    async def _listen_invalidations(self) -> None:
+
+        while True:
+            try:
+                redis_ = await self._invalidation_storage.redis()
+                channel, = await redis_.subscribe(self._invalidation_channel)
+                self.clear()  # invalidations could be missed before the subscription
+                while await channel.wait_message():
+                    self._apply_invalidation(await channel.get(encoding="UTF-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listening of the magazines invalidation channel has failed!")
+                self.clear()
+
+            await asyncio.sleep(1)  # to reconnect
+
+    def _apply_invalidation(self, message: str) -> None:
+
+        instance_id, _, raw_addresses = message.partition(" ")
+        if instance_id == self._instance_id:
+            return
+
+        for raw_address in raw_addresses.split(","):
+            chat, user = raw_address.split(":")
+            self._invalidate((int(chat), int(user)))
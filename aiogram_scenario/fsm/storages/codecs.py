@@ -0,0 +1,67 @@
+from array import array
+from typing import Sequence, Dict, List, Optional
+import sys
+
+from aiogram_scenario import errors
+
+
+class CompactStatesCodec:
+
+    """Packs magazine states into a version byte followed by 16-bit state codes (little-endian).
+
+    Every table is a version of the codes: the code of a state is its index in the table plus one,
+    the zero code is reserved for the initial state (None). Data is encoded with the last table and
+    decoded with the table of its version, so new states can be appended to the last table and
+    incompatible changes are made by adding a new table. States renamed since the previous tables
+    are passed as 'renamed' ({old_value: new_value}).
+    """
+
+    def __init__(self, tables: Sequence[Sequence[str]], *, renamed: Optional[Dict[str, str]] = None):
+
+        if not 0 < len(tables) <= 256:
+            raise ValueError("number of code tables must be from 1 to 256!")
+
+        renamed = renamed or {}
+        self._tables: List[List[Optional[str]]] = [[None] + [renamed.get(value, value) for value in table]
+                                                   for table in tables[:-1]]
+        self._tables.append([None] + list(tables[-1]))
+        self._version = len(self._tables) - 1
+        self._header = bytes((self._version,))
+        self._codes: Dict[Optional[str], int] = {value: code for code, value in enumerate(self._tables[-1])}
+
+        if len(self._codes) > 0xFFFF:
+            raise ValueError("too many states in the code table!")
+
+    @property
+    def version(self) -> int:
+
+        return self._version
+
+    def encode(self, states: List[Optional[str]]) -> bytes:
+
+        try:
+            codes = array("H", [self._codes[state] for state in states])
+        except KeyError as error:
+            raise errors.StateValueNotFoundError(error.args[0])
+
+        if sys.byteorder == "big":
+            codes.byteswap()
+
+        return self._header + codes.tobytes()
+
+    def decode(self, payload: bytes) -> List[Optional[str]]:
+
+        codes = array("H")
+        try:
+            table = self._tables[payload[0]]
+            codes.frombytes(payload[1:])
+        except (IndexError, ValueError):  # an unknown version or a truncated code
+            raise errors.MagazinePayloadDecodingError(payload)
+
+        if sys.byteorder == "big":
+            codes.byteswap()
+
+        try:
+            return [table[code] for code in codes]
+        except IndexError:
+            raise errors.MagazinePayloadDecodingError(payload)
@@ -1,46 +1,351 @@
-from typing import Union, List, AnyStr, Optional
+import asyncio
+import copy
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Union, AnyStr, Optional, Tuple, AsyncIterator, Dict, List, Set
 
 from aiogram.contrib.fsm_storage import memory
 
 from .base import BaseStorage
+from .base.storage import MagazinePayloadType, AddressType
+from .snapshots import SnapshotReader, MagazinesJournal, write_snapshot, dump_record, load_record
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryRecord:
+
+    __slots__ = ("magazine", "data", "bucket", "accessed_at")
+
+    def __init__(self):
+
+        self.magazine: Optional[MagazinePayloadType] = None  # None - the initial state only
+        self.data: Optional[dict] = None  # data and bucket are created on the first write
+        self.bucket: Optional[dict] = None
+        self.accessed_at = 0.0
+
+    @property
+    def is_empty(self) -> bool:
+
+        return (self.magazine is None) and (not self.data) and (not self.bucket)
 
 
 class MemoryStorage(BaseStorage, memory.MemoryStorage):
 
-    def resolve_address(self, chat, user):
+    def __init__(self, *args, max_records: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 snapshot_path: Optional[str] = None, snapshot_interval: Optional[float] = 300.0, **kwargs):
+
+        if (max_records is not None) and (max_records < 1):
+            raise ValueError("max records must be a positive number!")
+        if (idle_ttl is not None) and (idle_ttl <= 0):
+            raise ValueError("idle TTL must be a positive number!")
+
+        super().__init__(*args, **kwargs)
+        self.data: "OrderedDict[AddressType, MemoryRecord]" = OrderedDict()  # from least to most recently used
+        self.max_records = max_records  # None - without a limit
+        self.idle_ttl = idle_ttl  # None - records are not expired
+        self._is_evicting = (max_records is not None) or (idle_ttl is not None)
+
+        self.snapshot_path = snapshot_path  # None - sessions are not persisted
+        self.snapshot_interval = snapshot_interval  # None - only on close
+        self._snapshot: Optional[SnapshotReader] = None
+        self._restored_addresses = set()  # records of the snapshot which are taken into memory
+        self._journal: Optional[MagazinesJournal] = None
+        self._snapshot_lock = asyncio.Lock()
+        self._snapshot_task: Optional[asyncio.Task] = None
+        if snapshot_path is not None:
+            self._open_snapshot()
+
+    async def close(self):
+
+        await self.flush()
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            try:  # the periodic saving must finish writing the file before the last one is started
+                await self._snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self._snapshot_task = None
+        if self.snapshot_path is not None:
+            await self.save_snapshot()
+            self._journal.close()
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+
+        self.data.clear()
+
+    async def save_snapshot(self) -> None:
+
+        if self.snapshot_path is None:
+            raise RuntimeError("snapshot path is not set!")
+
+        async with self._snapshot_lock:
+            addresses = list(self.data)  # records are pickled in the executor, the loop only copies the keys
+            previous_restored_addresses = self._restored_addresses
+            self._restored_addresses = set(previous_restored_addresses)
+            self._journal.rotate()  # changes made while writing get into the new journal
+
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, _write_snapshot, self.snapshot_path, self.data, addresses,
+                                          self._snapshot, previous_restored_addresses)
+            is_cancelled = False
+            while not future.done():  # the thread is not stopped by the cancellation, the lock is held until the end
+                try:
+                    await asyncio.shield(future)
+                except asyncio.CancelledError:
+                    is_cancelled = True
+            records_number, written_addresses = future.result()
+            self._journal.remove_old()
 
-        chat_id, user_id = self.check_address(chat=chat, user=user)
-        if chat_id not in self.data:
-            self.data[chat_id] = {}
-        if user_id not in self.data[chat_id]:
-            self.data[chat_id][user_id] = {"magazine": [None], "data": {}, "bucket": {}}
+            # the previous snapshot is not closed, it is unmapped when iterations over it are finished
+            self._snapshot = SnapshotReader(self.snapshot_path)
+            # records from memory must not be restored after removing, as well as the ones restored while writing
+            self._restored_addresses = written_addresses | (self._restored_addresses - previous_restored_addresses)
 
-        return chat_id, user_id
+        if is_cancelled:
+            raise asyncio.CancelledError()
+        logger.info("Snapshot of %s sessions is saved to %r!", records_number, self.snapshot_path)
 
     async def set_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
-        chat, user = self.resolve_address(chat=chat, user=user)
-        magazine = self.get_magazine(chat=chat, user=user)
-        await magazine.load()
+
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
         await magazine.push(state)
 
     async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
 
-        chat, user = self.resolve_address(chat=chat, user=user)
-        magazine = self.get_magazine(user=user, chat=chat)
-        await magazine.load()
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
 
         return magazine.current_state
 
-    async def set_magazine_states(self, *, chat: Optional[int] = None, user: Optional[int] = None,
-                                  states: List[Optional[str]]) -> None:
+    def evict(self) -> int:
+
+        evicted_number = 0
+        if self.idle_ttl is not None:
+            expired_at = time.monotonic() - self.idle_ttl
+            while self.data:
+                address, record = next(iter(self.data.items()))
+                if record.accessed_at > expired_at:
+                    break
+                del self.data[address]
+                evicted_number += 1
+
+        if self.max_records is not None:
+            while len(self.data) > self.max_records:
+                self.data.popitem(last=False)
+                evicted_number += 1
+
+        return evicted_number
+
+    async def _get_data(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        record = self._get_record(chat, user)
+        if (record is None) or (record.data is None):
+            return {}
+
+        return copy.deepcopy(record.data)
+
+    async def _set_data(self, chat: int, user: int, data: Optional[Dict]) -> None:
+
+        if data:
+            self._get_or_create_record(chat, user).data = copy.deepcopy(data)
+        else:
+            record = self._get_record(chat, user)
+            if record is not None:
+                record.data = None
+                self._cleanup(chat, user)
+
+    async def _update_data(self, chat: int, user: int, data: Dict) -> None:
+
+        if not data:
+            return
+
+        record = self._get_or_create_record(chat, user)
+        if record.data is None:
+            record.data = dict(data)
+        else:  # the dict is not changed in place, the snapshot may be pickling it in the executor
+            record.data = {**record.data, **data}
+
+    async def _get_bucket(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        record = self._get_record(chat, user)
+        if (record is None) or (record.bucket is None):
+            return {}
+
+        return copy.deepcopy(record.bucket)
+
+    async def _set_bucket(self, chat: int, user: int, bucket: Optional[Dict]) -> None:
+
+        if bucket:
+            self._get_or_create_record(chat, user).bucket = copy.deepcopy(bucket)
+        else:
+            record = self._get_record(chat, user)
+            if record is not None:
+                record.bucket = None
+                self._cleanup(chat, user)
+
+    async def _update_bucket(self, chat: int, user: int, bucket: Dict) -> None:
+
+        if not bucket:
+            return
+
+        record = self._get_or_create_record(chat, user)
+        if record.bucket is None:
+            record.bucket = dict(bucket)
+        else:  # the dict is not changed in place, the snapshot may be pickling it in the executor
+            record.bucket = {**record.bucket, **bucket}
+
+    def _get_record(self, chat: int, user: int) -> Optional[MemoryRecord]:
+
+        record = self.data.get((chat, user))
+        if (record is None) and (self._snapshot is not None):
+            return self._restore_record(chat, user)
+        elif (record is not None) and self._is_evicting:
+            now = time.monotonic()
+            if (self.idle_ttl is not None) and (record.accessed_at + self.idle_ttl <= now):
+                del self.data[(chat, user)]
+                return None
+
+            record.accessed_at = now
+            self.data.move_to_end((chat, user))
+
+        return record
+
+    def _restore_record(self, chat: int, user: int) -> Optional[MemoryRecord]:
+
+        if (chat, user) in self._restored_addresses:  # it is removed from memory
+            return None
+
+        snapshot_record = self._snapshot.get((chat, user))
+        if snapshot_record is None:  # missing addresses are not remembered, the set is limited by the snapshot
+            return None
+        self._restored_addresses.add((chat, user))
+
+        record = self.data[(chat, user)] = MemoryRecord()
+        record.magazine, record.data, record.bucket = snapshot_record
+        if self._is_evicting:
+            record.accessed_at = time.monotonic()
+
+        return record
+
+    def _open_snapshot(self) -> None:
+
+        if os.path.exists(self.snapshot_path):
+            self._snapshot = SnapshotReader(self.snapshot_path)
+
+        self._journal = MagazinesJournal(self.snapshot_path + ".journal")
+        replayed_number = 0
+        for (chat, user), payload in self._journal.replay():
+            self._write_magazine(chat, user, payload)
+            replayed_number += 1
+        self._journal.merge_old()
+
+        logger.info("Sessions are restored from %r (%s in the snapshot, %s changes in the journal)!",
+                    self.snapshot_path, len(self._snapshot) if self._snapshot is not None else 0, replayed_number)
+
+    def _start_snapshotting(self) -> None:
+
+        if (self.snapshot_interval is not None) and (self._snapshot_task is None):
+            self._snapshot_task = asyncio.get_running_loop().create_task(self._save_snapshots_periodically())
+
+    async def _save_snapshots_periodically(self) -> None:
+
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.save_snapshot()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Saving of the snapshot to %r has failed!", self.snapshot_path)
+
+    def _get_or_create_record(self, chat: int, user: int) -> MemoryRecord:
+
+        record = self._get_record(chat, user)
+        if record is None:
+            record = self.data[(chat, user)] = MemoryRecord()
+            if self._is_evicting:
+                record.accessed_at = time.monotonic()
+                self.evict()
+
+        return record
+
+    def _cleanup(self, chat, user):
+
+        address = self.check_address(chat=chat, user=user)
+        record = self.data.get(address)
+        if (record is not None) and record.is_empty:
+            del self.data[address]
+
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
+
+        self._write_magazine(chat, user, payload)
+        if self._journal is not None:
+            self._journal.append((chat, user), payload)
+            self._start_snapshotting()
+
+    def _write_magazine(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
+
+        if payload == [None]:  # the default magazine is not stored
+            record = self._get_record(chat, user)
+            if record is not None:
+                record.magazine = None
+                self._cleanup(chat, user)
+        else:
+            self._get_or_create_record(chat, user).magazine = payload
+
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
+
+        record = self._get_record(chat, user)  # the record is not created for reading
+        if (record is None) or (record.magazine is None):
+            return [None]
+
+        return record.magazine  # a copy is made while decoding
+
+    async def _iter_magazines(self, batch_size: int) -> AsyncIterator[Tuple[int, int, MagazinePayloadType]]:
+
+        addresses = list(self.data)  # snapshot of the keys
+        for index, (chat, user) in enumerate(addresses, start=1):
+            record = self.data.get((chat, user))  # the record may be removed during the iteration
+            if (record is not None) and (record.magazine is not None):
+                yield chat, user, record.magazine
+            if not index % batch_size:
+                await asyncio.sleep(0)  # gives control to other tasks
+
+        if self._snapshot is None:
+            return
+
+        # a replaced snapshot stays mapped until the end of the iteration
+        for index, (address, raw_record) in enumerate(self._snapshot.iter_raw(), start=1):
+            if address not in self._restored_addresses:
+                magazine = load_record(raw_record)[0]
+                if magazine is not None:
+                    yield address[0], address[1], magazine
+            if not index % batch_size:
+                await asyncio.sleep(0)
+
+
+def _write_snapshot(path: str, records: Dict[AddressType, MemoryRecord], addresses: List[AddressType],
+                    snapshot: Optional[SnapshotReader],
+                    restored_addresses: Set[AddressType]) -> Tuple[int, Set[AddressType]]:
 
-        chat, user = self.resolve_address(chat=chat, user=user)
-        self.data[chat][user]["magazine"] = states.copy()
+    """Runs in the executor: fields of records are replaced by the loop, not changed in place."""
 
-    async def get_magazine_states(self, *, chat: Optional[int] = None,
-                                  user: Optional[int] = None) -> List[Optional[str]]:
+    raw_records = []
+    for address in addresses:
+        record = records.get(address)
+        if record is not None:  # it may be removed while writing
+            raw_records.append((address, dump_record((record.magazine, record.data, record.bucket))))
+    if snapshot is not None:  # records which are not restored are copied without decoding
+        raw_records.extend((address, raw_record) for address, raw_record in snapshot.iter_raw()
+                           if address not in restored_addresses)
+    write_snapshot(path, raw_records)
 
-        chat, user = self.resolve_address(chat=chat, user=user)
-        return self.data[chat][user]["magazine"].copy()
+    return len(raw_records), set(addresses)
@@ -1,9 +1,13 @@
-from typing import Union, List, Optional, AnyStr
+import asyncio
+import functools
+from typing import Union, Optional, AnyStr, Dict, List, Tuple, AsyncIterator
 
 from aiogram.contrib.fsm_storage import mongo
+from pymongo import UpdateOne
 from aiogram.contrib.fsm_storage.mongo import DATA, BUCKET
 
 from .base import BaseStorage
+from .base.storage import MagazinePayloadType, AddressType
 
 
 MAGAZINE = "aiogram_magazine"
@@ -12,13 +16,14 @@ COLLECTIONS = (MAGAZINE, DATA, BUCKET)
 
 class MongoStorage(BaseStorage, mongo.MongoStorage):
 
+    _transactions_support: Optional[bool] = None  # it is checked on the first commit
+
     async def set_state(self, *, chat: Union[str, int, None] = None,
                         user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
 
         chat, user = self.check_address(chat=chat, user=user)
-        magazine = self.get_magazine(user=user, chat=chat)
-        await magazine.load()
+        magazine = await self.load_magazine(chat=chat, user=user)
         await magazine.push(state)
 
     async def get_state(self, *, chat: Union[str, int, None] = None,
@@ -26,28 +31,88 @@ class MongoStorage(BaseStorage, mongo.MongoStorage):
                         default: Optional[str] = None) -> Optional[str]:
 
         chat, user = self.check_address(chat=chat, user=user)
-        magazine = self.get_magazine(user=user, chat=chat)
-        await magazine.load()
+        magazine = await self.load_magazine(chat=chat, user=user)
 
         return magazine.current_state
 
-    async def set_magazine_states(self, *, chat: Optional[int] = None,
-                                  user: Optional[int] = None,
-                                  states: List[Optional[str]]) -> None:
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
 
-        chat, user = self.check_address(chat=chat, user=user)
         db = await self.get_db()
         await db[MAGAZINE].update_one(filter={'chat': chat, 'user': user},
-                                      update={'$set': {'magazine': states}}, upsert=True)
+                                      update={'$set': {'magazine': payload}}, upsert=True)
 
-    async def get_magazine_states(self, *, chat: Optional[int] = None,
-                                  user: Optional[int] = None) -> List[Optional[str]]:
+    async def _set_magazines_states(self, payloads: Dict[AddressType, MagazinePayloadType]) -> None:
+
+        db = await self.get_db()
+        requests = [UpdateOne(filter={'chat': chat, 'user': user}, update={'$set': {'magazine': payload}}, upsert=True)
+                    for (chat, user), payload in payloads.items()]
+        await db[MAGAZINE].bulk_write(requests, ordered=False)
+
+    async def _commit_transaction(self, chat: int, user: int, payload: Optional[MagazinePayloadType],
+                                  data: Optional[dict], bucket: Optional[dict]) -> None:
+
+        db = await self.get_db()
+        filter_ = {'chat': chat, 'user': user}
+        writes = []  # the magazine, data and bucket are in different collections
+        if payload is not None:
+            writes.append(functools.partial(db[MAGAZINE].update_one, filter=filter_,
+                                            update={'$set': {'magazine': payload}}, upsert=True))
+        if data is not None:
+            if data:
+                writes.append(functools.partial(db[DATA].update_one, filter=filter_,
+                                                update={'$set': {'data': data}}, upsert=True))
+            else:
+                writes.append(functools.partial(db[DATA].delete_one, filter=filter_))
+        if bucket is not None:
+            writes.append(functools.partial(db[BUCKET].update_one, filter=filter_,
+                                            update={'$set': {'bucket': bucket}}, upsert=True))
+
+        if (len(writes) > 1) and await self._is_transactions_supported(db):
+            client = await self.get_client()
+            async with await client.start_session() as session:
+                async with session.start_transaction():  # operations of a session are not concurrent
+                    for write in writes:
+                        await write(session=session)
+        else:  # a standalone server has no transactions, the writes are not atomic
+            await asyncio.gather(*(write() for write in writes))
+
+    async def _is_transactions_supported(self, db) -> bool:
+
+        if self._transactions_support is None:  # replica sets and sharded clusters only
+            server_info = await db.command("ismaster")
+            self._transactions_support = ("setName" in server_info) or (server_info.get("msg") == "isdbgrid")
+
+        return self._transactions_support
+
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
 
-        chat, user = self.check_address(chat=chat, user=user)
         db = await self.get_db()
         result = await db[MAGAZINE].find_one(filter={'chat': chat, 'user': user})
         return result.get('magazine') if result else [None]
 
+    async def _get_magazines_states(self, addresses: List[AddressType]) -> Dict[AddressType, MagazinePayloadType]:
+
+        db = await self.get_db()
+        chats = list({chat for chat, _ in addresses})
+        users = list({user for _, user in addresses})
+        payloads = dict.fromkeys(addresses)
+        # the cross product of chats and users is filtered out, the index is used for both fields
+        async for result in db[MAGAZINE].find(filter={'chat': {'$in': chats}, 'user': {'$in': users}},
+                                              projection={'_id': False, 'chat': True, 'user': True, 'magazine': True}):
+            address = (result['chat'], result['user'])
+            if address in payloads:
+                payloads[address] = result.get('magazine')
+
+        return {address: [None] if payload is None else payload for address, payload in payloads.items()}
+
+    async def _iter_magazines(self, batch_size: int) -> AsyncIterator[Tuple[int, int, MagazinePayloadType]]:
+
+        db = await self.get_db()
+        cursor = db[MAGAZINE].find(filter={}, projection={'_id': False, 'chat': True, 'user': True, 'magazine': True},
+                                   batch_size=batch_size)
+        async for result in cursor:
+            yield result['chat'], result['user'], result.get('magazine') or [None]
+
     async def reset_all(self, full=True):
 
         db = await self.get_db()
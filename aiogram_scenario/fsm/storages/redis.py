@@ -1,48 +1,219 @@
-from typing import Union, List, Optional, AnyStr
+from typing import Union, Optional, AnyStr, Dict, List, Tuple, AsyncIterator
+import hashlib
 
 from aiogram.contrib.fsm_storage import redis
+from aiogram.contrib.fsm_storage.redis import STATE_DATA_KEY, STATE_BUCKET_KEY
 from aiogram.utils import json
 
-from .base import BaseStorage
+from .base import BaseStorage, Magazine
+from .base.storage import MagazinePayloadType, AddressType
+from .base.context import get_transaction
+from .serializers import (AbstractMagazineSerializer, JSONMagazineSerializer, RawBytesMagazineSerializer,
+                          MagazineSerializersRegistry)
+from aiogram_scenario import errors
 
 
 STATE_MAGAZINE_KEY = "magazine"
 
+# KEYS[1] - magazine key
+# ARGV[1] - JSON array with the expected current state, ARGV[2] - JSON array with the pushed state,
+# ARGV[3] - magazine depth (0 - unlimited), ARGV[4] - TTL in seconds (0 - without TTL)
+PUSH_MAGAZINE_STATE_SCRIPT = """
+local raw = redis.call('GET', KEYS[1])
+local states
+if raw then
+    if string.sub(raw, 1, 1) ~= '[' then  -- not JSON, the payload is pushed by the client
+        return {-1, ''}
+    end
+    states = cjson.decode(raw)
+else
+    states = {cjson.null}
+end
+
+local current_state = states[#states]
+if current_state ~= cjson.decode(ARGV[1])[1] then
+    return {0, cjson.encode({current_state})}
+end
+
+local state = cjson.decode(ARGV[2])[1]
+local position
+for index = 1, #states do
+    if states[index] == state then
+        position = index
+        break
+    end
+end
+if position then
+    for index = #states, position + 1, -1 do
+        states[index] = nil
+    end
+else
+    states[#states + 1] = state
+    local depth = tonumber(ARGV[3])
+    while (depth > 0) and (#states > depth) do
+        table.remove(states, 1)
+    end
+end
+
+local payload = cjson.encode(states)
+local ttl = tonumber(ARGV[4])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], payload, 'EX', ttl)
+else
+    redis.call('SET', KEYS[1], payload)
+end
+
+return {1, payload}
+"""
+PUSH_MAGAZINE_STATE_SCRIPT_SHA = hashlib.sha1(PUSH_MAGAZINE_STATE_SCRIPT.encode()).hexdigest()
+
 
 class RedisStorage(BaseStorage, redis.RedisStorage2):
 
+    def __init__(self, *args, magazine_serializer: Optional[AbstractMagazineSerializer] = None, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self._magazine_serializer = magazine_serializer or JSONMagazineSerializer()
+        self._raw_bytes_serializer = RawBytesMagazineSerializer()
+        self._magazine_serializers = MagazineSerializersRegistry(self._magazine_serializer)
+
     async def set_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                         state: Optional[AnyStr] = None):
 
         chat, user = self.check_address(chat=chat, user=user)
-        magazine = self.get_magazine(chat=chat, user=user)
-        await magazine.load()
+        magazine = await self.load_magazine(chat=chat, user=user)
         await magazine.push(state)
 
     async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
                         default: Optional[str] = None) -> Optional[str]:
 
         chat, user = self.check_address(chat=chat, user=user)
-        magazine = self.get_magazine(user=user, chat=chat)
-        await magazine.load()
+        magazine = await self.load_magazine(chat=chat, user=user)
         return magazine.current_state
 
-    async def set_magazine_states(self, *, chat: Optional[int] = None, user: Optional[int] = None,
-                                  states: List[Optional[str]]) -> None:
+    async def push_magazine_state(self, magazine: Magazine, state: Optional[str]) -> None:
+
+        if (
+            self.is_write_behind
+            or (self.states_codec is not None)
+            or (not isinstance(self._magazine_serializer, JSONMagazineSerializer))
+            or (get_transaction(self, magazine.chat_id, magazine.user_id) is not None)
+        ):  # the script works with pushed JSON only, in the transaction the state is written on the commit
+            await super().push_magazine_state(magazine, state)
+            return
+
+        key = self.generate_key(magazine.chat_id, magazine.user_id, STATE_MAGAZINE_KEY)
+        args = [json.dumps([magazine.current_state]), json.dumps([state]),
+                self.magazine_depth or 0, self._state_ttl or 0]
+        is_pushed, payload = await self.execute_script(PUSH_MAGAZINE_STATE_SCRIPT, PUSH_MAGAZINE_STATE_SCRIPT_SHA,
+                                                       keys=[key], args=args)
+        if is_pushed == -1:  # the stored payload is written in another format (during migration)
+            await super().push_magazine_state(magazine, state)
+            return
+        elif not is_pushed:
+            self.uncache_magazine(magazine)
+            raise errors.MagazineIsChangedError(chat_id=magazine.chat_id, user_id=magazine.user_id,
+                                                expected_state=magazine.current_state,
+                                                current_state=json.loads(payload)[0])
+
+        magazine.assign(json.loads(payload))
+
+    async def execute_script(self, script: str, sha: str, *, keys: list, args: list):
+
+        redis_ = await self.redis()
+        try:
+            return await redis_.evalsha(sha, keys=keys, args=args)
+        except Exception as error:
+            if not str(error).startswith("NOSCRIPT"):
+                raise
+
+        return await redis_.eval(script, keys=keys, args=args)  # loads the script into the cache
+
+    def _dump_magazine_payload(self, payload: MagazinePayloadType) -> bytes:
+
+        if isinstance(payload, bytes):  # already encoded by the codec
+            return self._raw_bytes_serializer.dumps(payload)
+
+        return self._magazine_serializer.dumps(payload)
+
+    def _load_magazine_payload(self, raw_payload: bytes) -> MagazinePayloadType:
+
+        return self._magazine_serializers.get(raw_payload).loads(raw_payload)
+
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
 
-        chat, user = self.check_address(chat=chat, user=user)
         key = self.generate_key(chat, user, STATE_MAGAZINE_KEY)
         redis_ = await self.redis()
-        await redis_.set(key, json.dumps(states), expire=self._state_ttl)
+        await redis_.set(key, self._dump_magazine_payload(payload), expire=self._state_ttl)
 
-    async def get_magazine_states(self, *, chat: Optional[int] = None,
-                                  user: Optional[int] = None) -> List[Optional[str]]:
+    async def _set_magazines_states(self, payloads: Dict[AddressType, MagazinePayloadType]) -> None:
+
+        redis_ = await self.redis()
+        if self._state_ttl:
+            pipeline = redis_.pipeline()
+            for (chat, user), payload in payloads.items():
+                pipeline.set(self.generate_key(chat, user, STATE_MAGAZINE_KEY), self._dump_magazine_payload(payload),
+                             expire=self._state_ttl)
+            await pipeline.execute()
+        else:
+            pairs = []
+            for (chat, user), payload in payloads.items():
+                pairs.extend((self.generate_key(chat, user, STATE_MAGAZINE_KEY), self._dump_magazine_payload(payload)))
+            await redis_.mset(*pairs)
+
+    async def _commit_transaction(self, chat: int, user: int, payload: Optional[MagazinePayloadType],
+                                  data: Optional[dict], bucket: Optional[dict]) -> None:
+
+        redis_ = await self.redis()
+        multi_exec = redis_.multi_exec()  # one round trip, the writes are applied together
+        if payload is not None:
+            multi_exec.set(self.generate_key(chat, user, STATE_MAGAZINE_KEY), self._dump_magazine_payload(payload),
+                           expire=self._state_ttl)
+        values = ((STATE_DATA_KEY, data, self._data_ttl), (STATE_BUCKET_KEY, bucket, self._bucket_ttl))
+        for suffix, value, ttl in values:
+            if value is None:
+                continue
+            key = self.generate_key(chat, user, suffix)
+            if value:
+                multi_exec.set(key, json.dumps(value), expire=ttl)
+            else:
+                multi_exec.delete(key)
+        await multi_exec.execute()
+
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
 
-        chat, user = self.check_address(chat=chat, user=user)
         key = self.generate_key(chat, user, STATE_MAGAZINE_KEY)
         redis_ = await self.redis()
-        raw_result = await redis_.get(key, encoding='utf8')
+        raw_result = await redis_.get(key)
         if raw_result:
-            return json.loads(raw_result)
+            return self._load_magazine_payload(raw_result)
 
         return [None]
+
+    async def _get_magazines_states(self, addresses: List[AddressType]) -> Dict[AddressType, MagazinePayloadType]:
+
+        keys = [self.generate_key(chat, user, STATE_MAGAZINE_KEY) for chat, user in addresses]
+        redis_ = await self.redis()
+        raw_results = await redis_.mget(*keys)
+
+        return {address: self._load_magazine_payload(raw_result) if raw_result else [None]
+                for address, raw_result in zip(addresses, raw_results)}
+
+    async def _iter_magazines(self, batch_size: int) -> AsyncIterator[Tuple[int, int, MagazinePayloadType]]:
+
+        redis_ = await self.redis()
+        pattern = self.generate_key("*", "*", STATE_MAGAZINE_KEY)
+        cursor = 0
+        while True:  # SCAN does not block the server, unlike KEYS
+            cursor, keys = await redis_.scan(cursor, match=pattern, count=batch_size)
+            if keys:
+                raw_results = await redis_.mget(*keys)
+                for key, raw_result in zip(keys, raw_results):
+                    if not raw_result:  # expired between the calls
+                        continue
+                    if isinstance(key, bytes):
+                        key = key.decode()
+                    chat, user = key.rsplit(":", 3)[-3:-1]
+                    yield int(chat), int(user), self._load_magazine_payload(raw_result)
+            if not cursor:
+                break
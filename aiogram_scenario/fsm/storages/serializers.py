@@ -0,0 +1,147 @@
+from abc import ABC, abstractmethod
+from typing import List, Optional, Dict, Type
+
+from aiogram.utils import json
+
+from aiogram_scenario import errors
+
+
+JSON_PREFIX = b"["  # JSON is stored without a header, as an array of states
+# codec payloads are stored behind their own header, so versions of the states codec don't overlap headers
+
+
+class AbstractMagazineSerializer(ABC):
+
+    header: bytes
+
+    def dumps(self, states: List[Optional[str]]) -> bytes:
+
+        return self.header + self._dumps(states)
+
+    def loads(self, raw_payload: bytes) -> List[Optional[str]]:
+
+        return self._loads(memoryview(raw_payload)[len(self.header):])
+
+    @abstractmethod
+    def _dumps(self, states: List[Optional[str]]) -> bytes:
+
+        pass
+
+    @abstractmethod
+    def _loads(self, data: memoryview) -> List[Optional[str]]:
+
+        pass
+
+
+class JSONMagazineSerializer(AbstractMagazineSerializer):
+
+    header = b""
+
+    def loads(self, raw_payload: bytes) -> List[Optional[str]]:
+
+        return json.loads(raw_payload)  # without a header, there is nothing to cut off
+
+    def _dumps(self, states: List[Optional[str]]) -> bytes:
+
+        return json.dumps(states).encode()
+
+    def _loads(self, data: memoryview) -> List[Optional[str]]:
+
+        return json.loads(data.tobytes())
+
+
+class ORJSONMagazineSerializer(AbstractMagazineSerializer):
+
+    header = b"\xf1"
+
+    def __init__(self):
+
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("""to use this serializer, you need to install «orjson»!
+More info: https://github.com/ijl/orjson#install""")
+
+        self._orjson = orjson
+
+    def _dumps(self, states: List[Optional[str]]) -> bytes:
+
+        return self._orjson.dumps(states)
+
+    def _loads(self, data: memoryview) -> List[Optional[str]]:
+
+        return self._orjson.loads(data)
+
+
+class MsgPackMagazineSerializer(AbstractMagazineSerializer):
+
+    header = b"\xf2"
+
+    def __init__(self):
+
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("""to use this serializer, you need to install «msgpack»!
+More info: https://github.com/msgpack/msgpack-python#install""")
+
+        self._msgpack = msgpack
+
+    def _dumps(self, states: List[Optional[str]]) -> bytes:
+
+        return self._msgpack.packb(states, use_bin_type=True)
+
+    def _loads(self, data: memoryview) -> List[Optional[str]]:
+
+        return self._msgpack.unpackb(data, raw=False)
+
+
+class RawBytesMagazineSerializer:
+
+    """Stores payloads that are already encoded by the states codec."""
+
+    header = b"\xf3"
+
+    def dumps(self, payload: bytes) -> bytes:
+
+        return self.header + payload
+
+    def loads(self, raw_payload: bytes) -> bytes:
+
+        return raw_payload[len(self.header):]
+
+
+_SERIALIZERS_TYPES: Dict[bytes, Type] = {
+    ORJSONMagazineSerializer.header: ORJSONMagazineSerializer,
+    MsgPackMagazineSerializer.header: MsgPackMagazineSerializer,
+    RawBytesMagazineSerializer.header: RawBytesMagazineSerializer
+}
+
+
+class MagazineSerializersRegistry:
+
+    """Finds the serializer of a stored payload by its header, so payloads written in any format can be read."""
+
+    def __init__(self, serializer: AbstractMagazineSerializer):
+
+        self._json_serializer = JSONMagazineSerializer()
+        self._serializers = {serializer.header: serializer}
+
+    def get(self, raw_payload: bytes):
+
+        header = raw_payload[:1]
+        if header == JSON_PREFIX:
+            return self._json_serializer
+
+        try:
+            return self._serializers[header]
+        except KeyError:
+            pass
+
+        try:
+            serializer_type = _SERIALIZERS_TYPES[header]
+        except KeyError:
+            raise errors.MagazinePayloadDecodingError(raw_payload)
+
+        serializer = self._serializers[header] = serializer_type()
+        return serializer
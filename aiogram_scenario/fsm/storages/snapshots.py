@@ -0,0 +1,176 @@
+import mmap
+import os
+import pickle
+import struct
+from typing import Optional, Iterator, Tuple, Iterable, List, Any
+
+from .base.storage import AddressType
+
+
+MAGIC = b"AGSS"
+VERSION = 1
+HEADER = struct.Struct("<4sBQ")  # magic, version, number of records
+INDEX_ENTRY = struct.Struct("<qqQI")  # chat, user, offset, length
+JOURNAL_ENTRY = struct.Struct("<qqI")  # chat, user, length
+
+RecordType = Tuple[Any, Optional[dict], Optional[dict]]  # (magazine, data, bucket)
+
+
+def dump_record(record: RecordType) -> bytes:
+
+    return pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_record(raw_record: bytes) -> RecordType:
+
+    return pickle.loads(raw_record)
+
+
+def write_snapshot(path: str, raw_records: List[Tuple[AddressType, bytes]]) -> None:
+
+    """Writes records sorted by the address, so the index can be searched without loading."""
+
+    raw_records = sorted(raw_records, key=lambda item: item[0])
+    temporary_path = path + ".tmp"
+    offset = HEADER.size + INDEX_ENTRY.size * len(raw_records)
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(raw_records)))
+        for (chat, user), raw_record in raw_records:
+            file.write(INDEX_ENTRY.pack(chat, user, offset, len(raw_record)))
+            offset += len(raw_record)
+        for _, raw_record in raw_records:
+            file.write(raw_record)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+class SnapshotReader:
+
+    """Reads records from the memory-mapped snapshot, the index is searched by bisection."""
+
+    def __init__(self, path: str):
+
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self._size = HEADER.unpack_from(self._mmap, 0)
+        if (magic != MAGIC) or (version != VERSION):
+            self._mmap.close()
+            raise ValueError(f"{path!r} is not a snapshot of version {VERSION}!")
+
+    def __len__(self):
+
+        return self._size
+
+    def close(self) -> None:
+
+        self._mmap.close()
+
+    def get_raw(self, address: AddressType) -> Optional[bytes]:
+
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            chat, user, offset, length = INDEX_ENTRY.unpack_from(self._mmap, HEADER.size + INDEX_ENTRY.size * middle)
+            if (chat, user) < address:
+                low = middle + 1
+            elif (chat, user) > address:
+                high = middle
+            else:
+                return self._mmap[offset:offset + length]
+
+        return None
+
+    def get(self, address: AddressType) -> Optional[RecordType]:
+
+        raw_record = self.get_raw(address)
+        if raw_record is None:
+            return None
+
+        return load_record(raw_record)
+
+    def iter_raw(self) -> Iterator[Tuple[AddressType, bytes]]:
+
+        for index in range(self._size):
+            chat, user, offset, length = INDEX_ENTRY.unpack_from(self._mmap, HEADER.size + INDEX_ENTRY.size * index)
+            yield (chat, user), self._mmap[offset:offset + length]
+
+
+class MagazinesJournal:
+
+    """Append-only log of magazines changes made after the last snapshot."""
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.old_path = path + ".old"  # the journal of the snapshot in progress
+        self._file = open(path, "ab")
+
+    def append(self, address: AddressType, payload) -> None:
+
+        raw_payload = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        self._file.write(JOURNAL_ENTRY.pack(address[0], address[1], len(raw_payload)) + raw_payload)
+        self._file.flush()  # survives a crash of the process
+
+    def rotate(self) -> None:
+
+        self._file.close()
+        if os.path.exists(self.old_path):  # the previous snapshot is not written, its changes are kept
+            _append_file(self.old_path, self.path)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.old_path)
+        self._file = open(self.path, "ab")
+
+    def remove_old(self) -> None:
+
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def close(self) -> None:
+
+        self._file.close()
+
+    def replay(self) -> Iterator[Tuple[AddressType, Any]]:
+
+        for path in (self.old_path, self.path):
+            if os.path.exists(path):
+                yield from _read_journal(path)
+
+    def merge_old(self) -> None:
+
+        """Keeps the changes of the unfinished snapshot in the current journal."""
+
+        if not os.path.exists(self.old_path):
+            return
+
+        self._file.close()
+        _append_file(self.old_path, self.path)
+        os.replace(self.old_path, self.path)
+        self._file = open(self.path, "ab")
+
+
+def _read_journal(path: str) -> Iterable[Tuple[AddressType, Any]]:
+
+    with open(path, "rb") as file:
+        while True:
+            raw_header = file.read(JOURNAL_ENTRY.size)
+            if len(raw_header) < JOURNAL_ENTRY.size:
+                return
+            chat, user, length = JOURNAL_ENTRY.unpack(raw_header)
+            raw_payload = file.read(length)
+            if len(raw_payload) < length:  # the last entry is torn by a crash
+                return
+            yield (chat, user), pickle.loads(raw_payload)
+
+
+def _append_file(destination_path: str, source_path: str) -> None:
+
+    with open(destination_path, "ab") as destination, open(source_path, "rb") as source:
+        while True:
+            chunk = source.read(1 << 20)
+            if not chunk:
+                break
+            destination.write(chunk)
@@ -0,0 +1,312 @@
+import asyncio
+import copy
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, AnyStr, Dict, List, Tuple, AsyncIterator, Callable
+
+from aiogram.utils import json
+
+from .base import BaseStorage
+from .base.storage import MagazinePayloadType, AddressType
+
+
+logger = logging.getLogger(__name__)
+
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS aiogram_sessions (
+    chat INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    magazine BLOB,
+    data TEXT,
+    bucket TEXT,
+    PRIMARY KEY (chat, user)
+) WITHOUT ROWID
+"""
+SELECT_MAGAZINE_SQL = "SELECT magazine FROM aiogram_sessions WHERE chat = ? AND user = ?"
+SELECT_MAGAZINES_SQL = ("SELECT chat, user, magazine FROM aiogram_sessions "
+                        "WHERE magazine IS NOT NULL AND (chat, user) > (?, ?) ORDER BY chat, user LIMIT ?")
+SELECT_DATA_SQL = "SELECT data FROM aiogram_sessions WHERE chat = ? AND user = ?"
+SELECT_BUCKET_SQL = "SELECT bucket FROM aiogram_sessions WHERE chat = ? AND user = ?"
+UPSERT_MAGAZINE_SQL = ("INSERT INTO aiogram_sessions (chat, user, magazine) VALUES (?, ?, ?) "
+                       "ON CONFLICT (chat, user) DO UPDATE SET magazine = excluded.magazine")
+UPSERT_DATA_SQL = ("INSERT INTO aiogram_sessions (chat, user, data) VALUES (?, ?, ?) "
+                   "ON CONFLICT (chat, user) DO UPDATE SET data = excluded.data")
+UPSERT_BUCKET_SQL = ("INSERT INTO aiogram_sessions (chat, user, bucket) VALUES (?, ?, ?) "
+                     "ON CONFLICT (chat, user) DO UPDATE SET bucket = excluded.bucket")
+
+
+def _dump_magazine_payload(payload: MagazinePayloadType) -> Union[str, bytes]:
+
+    if isinstance(payload, bytes):  # already encoded by the codec
+        return payload
+
+    return json.dumps(payload)
+
+
+def _load_magazine_payload(raw_payload: Union[str, bytes, None]) -> MagazinePayloadType:
+
+    if raw_payload is None:
+        return [None]
+    elif isinstance(raw_payload, bytes):
+        return raw_payload
+
+    return json.loads(raw_payload)
+
+
+class SQLiteStorage(BaseStorage):
+
+    """Stores sessions in one SQLite file in WAL mode.
+
+    All queries run on a dedicated thread with one connection. Writes are group-committed:
+    a transaction is committed after commit_size writes or commit_interval seconds, and with
+    wait_commit the writers wait for it, so several writes share one sync of the file.
+    """
+
+    def __init__(self, path: str, *, commit_size: int = 100, commit_interval: float = 0.01,
+                 wait_commit: bool = True, **kwargs):
+
+        if commit_size < 1:
+            raise ValueError("commit size must be a positive number!")
+
+        super().__init__(**kwargs)
+        self.path = path
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.wait_commit = wait_commit  # False - a crash loses writes of the last interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aiogram_scenario_sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connecting: Optional[asyncio.Future] = None
+        self._uncommitted_number = 0
+        self._commit_future: Optional[asyncio.Future] = None
+        self._commit_timer: Optional[asyncio.TimerHandle] = None
+        self._commit_task: Optional[asyncio.Future] = None
+
+    async def close(self):
+
+        await self.flush()
+        if self._connection is not None:
+            await self._commit()
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+
+    async def wait_closed(self):
+
+        pass
+
+    async def set_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        state: Optional[AnyStr] = None):
+
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
+        await magazine.push(state)
+
+    async def get_state(self, *, chat: Union[str, int, None] = None, user: Union[str, int, None] = None,
+                        default: Optional[str] = None) -> Optional[str]:
+
+        chat, user = self.check_address(chat=chat, user=user)
+        magazine = await self.load_magazine(chat=chat, user=user)
+        return magazine.current_state
+
+    def has_bucket(self):
+
+        return True
+
+    async def reset_all(self, full=True):
+
+        if full:
+            await self._write(self._execute, "DELETE FROM aiogram_sessions", ())
+        else:
+            await self._write(self._execute, "UPDATE aiogram_sessions SET magazine = NULL", ())
+
+    async def _get_data(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        raw_data = await self._fetch_value(SELECT_DATA_SQL, chat, user)
+        return json.loads(raw_data) if raw_data else copy.deepcopy(default or {})
+
+    async def _set_data(self, chat: int, user: int, data: Optional[Dict]) -> None:
+
+        await self._write(self._execute, UPSERT_DATA_SQL, (chat, user, json.dumps(data) if data else None))
+
+    async def _update_data(self, chat: int, user: int, data: Dict) -> None:
+
+        await self._write(self._update_json, SELECT_DATA_SQL, UPSERT_DATA_SQL, chat, user, data)
+
+    async def _get_bucket(self, chat: int, user: int, default: Optional[dict]) -> Dict:
+
+        raw_bucket = await self._fetch_value(SELECT_BUCKET_SQL, chat, user)
+        return json.loads(raw_bucket) if raw_bucket else copy.deepcopy(default or {})
+
+    async def _set_bucket(self, chat: int, user: int, bucket: Optional[Dict]) -> None:
+
+        await self._write(self._execute, UPSERT_BUCKET_SQL, (chat, user, json.dumps(bucket) if bucket else None))
+
+    async def _update_bucket(self, chat: int, user: int, bucket: Dict) -> None:
+
+        await self._write(self._update_json, SELECT_BUCKET_SQL, UPSERT_BUCKET_SQL, chat, user, bucket)
+
+    async def _commit_transaction(self, chat: int, user: int, payload: Optional[MagazinePayloadType],
+                                  data: Optional[dict], bucket: Optional[dict]) -> None:
+
+        await self._write(self._write_session, chat, user, payload, data, bucket)  # one group-committed write
+
+    async def _set_magazine_states(self, chat: int, user: int, payload: MagazinePayloadType) -> None:
+
+        await self._write(self._execute, UPSERT_MAGAZINE_SQL, (chat, user, _dump_magazine_payload(payload)))
+
+    async def _set_magazines_states(self, payloads: Dict[AddressType, MagazinePayloadType]) -> None:
+
+        parameters = [(chat, user, _dump_magazine_payload(payload)) for (chat, user), payload in payloads.items()]
+        await self._write(self._execute_many, UPSERT_MAGAZINE_SQL, parameters)
+
+    async def _get_magazine_states(self, chat: int, user: int) -> MagazinePayloadType:
+
+        return _load_magazine_payload(await self._fetch_value(SELECT_MAGAZINE_SQL, chat, user))
+
+    async def _get_magazines_states(self, addresses: List[AddressType]) -> Dict[AddressType, MagazinePayloadType]:
+
+        raw_payloads = await self._run(self._fetch_values, SELECT_MAGAZINE_SQL, addresses)
+        return {address: _load_magazine_payload(raw_payload) for address, raw_payload in zip(addresses, raw_payloads)}
+
+    async def _iter_magazines(self, batch_size: int) -> AsyncIterator[Tuple[int, int, MagazinePayloadType]]:
+
+        last_address = (-(1 << 63), -(1 << 63))
+        while True:  # pages by the key, the connection is not held between batches
+            rows = await self._run(self._fetch_all, SELECT_MAGAZINES_SQL, (*last_address, batch_size))
+            for chat, user, raw_payload in rows:
+                yield chat, user, _load_magazine_payload(raw_payload)
+            if len(rows) < batch_size:
+                break
+            last_address = rows[-1][:2]
+
+    async def _run(self, function: Callable, *args):
+
+        if self._connection is None:
+            await self._connect()
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def _connect(self) -> None:
+
+        if self._connecting is None:
+            loop = asyncio.get_running_loop()
+            self._connecting = loop.run_in_executor(self._executor, self._open_connection)
+        try:
+            self._connection = await asyncio.shield(self._connecting)
+        except BaseException:
+            self._connecting = None
+            raise
+
+    def _open_connection(self) -> sqlite3.Connection:
+
+        connection = sqlite3.connect(self.path, isolation_level="DEFERRED", cached_statements=256)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")  # WAL is synced on checkpoints
+        connection.execute(CREATE_TABLE_SQL)
+        connection.commit()
+
+        return connection
+
+    async def _write(self, function: Callable, *args) -> None:
+
+        await self._run(function, *args)
+
+        loop = asyncio.get_running_loop()
+        if self._commit_future is None:
+            self._commit_future = loop.create_future()
+        commit_future = self._commit_future
+        self._uncommitted_number += 1
+        if self._uncommitted_number >= self.commit_size:
+            self._start_commit()
+        elif self._commit_timer is None:
+            self._commit_timer = loop.call_later(self.commit_interval, self._start_commit)
+
+        if self.wait_commit:
+            await asyncio.shield(commit_future)
+
+    def _start_commit(self) -> None:
+
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        commit_future, self._commit_future = self._commit_future, None
+        self._uncommitted_number = 0
+        if commit_future is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self._executor, self._connection.commit)
+        task.add_done_callback(lambda done_task: _resolve_future(commit_future, done_task))
+        if not self.wait_commit:
+            commit_future.add_done_callback(_consume_exception)
+        self._commit_task = task
+
+    async def _commit(self) -> None:
+
+        self._start_commit()
+        if self._commit_task is not None:
+            await self._commit_task
+
+    async def _fetch_value(self, sql: str, chat: int, user: int):
+
+        rows = await self._run(self._fetch_all, sql, (chat, user))
+        return rows[0][0] if rows else None
+
+    def _fetch_all(self, sql: str, parameters: tuple) -> list:
+
+        return self._connection.execute(sql, parameters).fetchall()
+
+    def _fetch_values(self, sql: str, addresses: List[AddressType]) -> list:
+
+        values = []
+        for address in addresses:
+            row = self._connection.execute(sql, address).fetchone()
+            values.append(row[0] if row else None)
+
+        return values
+
+    def _execute(self, sql: str, parameters: tuple) -> None:
+
+        self._connection.execute(sql, parameters)
+
+    def _execute_many(self, sql: str, parameters: list) -> None:
+
+        self._connection.executemany(sql, parameters)
+
+    def _write_session(self, chat: int, user: int, payload: Optional[MagazinePayloadType],
+                       data: Optional[dict], bucket: Optional[dict]) -> None:
+
+        if payload is not None:
+            self._connection.execute(UPSERT_MAGAZINE_SQL, (chat, user, _dump_magazine_payload(payload)))
+        if data is not None:
+            self._connection.execute(UPSERT_DATA_SQL, (chat, user, json.dumps(data) if data else None))
+        if bucket is not None:
+            self._connection.execute(UPSERT_BUCKET_SQL, (chat, user, json.dumps(bucket) if bucket else None))
+
+    def _update_json(self, select_sql: str, upsert_sql: str, chat: int, user: int, update: dict) -> None:
+
+        row = self._connection.execute(select_sql, (chat, user)).fetchone()
+        value = json.loads(row[0]) if (row and row[0]) else {}
+        value.update(update)
+        self._connection.execute(upsert_sql, (chat, user, json.dumps(value)))
+
+
+def _resolve_future(future: asyncio.Future, task: asyncio.Future) -> None:
+
+    if future.done():
+        return
+
+    error = task.exception()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(None)
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+
+    error = future.exception()  # nobody waits for the commit
+    if error is not None:
+        logger.error("Commit of the SQLite storage has failed!", exc_info=error)
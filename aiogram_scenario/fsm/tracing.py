@@ -0,0 +1,241 @@
+import random
+import time
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from typing import Optional, Any, Dict, Tuple, List
+
+from .state import BaseState
+
+
+LOAD_PHASE = "load"
+LOCK_PHASE = "lock"
+EXIT_PHASE = "exit"
+ENTER_PHASE = "enter"
+COMMIT_PHASE = "commit"
+PHASES = (LOAD_PHASE, LOCK_PHASE, EXIT_PHASE, ENTER_PHASE, COMMIT_PHASE)
+
+NULL_CONTEXT = nullcontext()
+
+
+class TransitionTrace:
+
+    __slots__ = ("tracer", "chat_id", "user_id", "source_state", "destination_state", "durations", "span")
+
+    def __init__(self, tracer: "AbstractTransitionTracer", *, chat_id: int, user_id: int):
+
+        self.tracer = tracer
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.source_state: Optional[BaseState] = None  # states are known after loading of the magazine
+        self.destination_state: Optional[BaseState] = None
+        self.durations: Dict[str, float] = {}  # phase -> seconds
+        self.span: Any = None  # for the tracer
+
+    def __enter__(self):
+
+        self.tracer.on_transition_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.tracer.on_transition_end(self, exc_val)
+
+    def phase(self, name: str) -> "PhaseContext":
+
+        return PhaseContext(self, name)
+
+
+class PhaseContext:
+
+    __slots__ = ("_trace", "_name", "_span", "_started_at")
+
+    def __init__(self, trace: TransitionTrace, name: str):
+
+        self._trace = trace
+        self._name = name
+        self._span = None
+        self._started_at = 0.0
+
+    def __enter__(self):
+
+        self._span = self._trace.tracer.on_phase_start(self._name, self._trace)
+        self._started_at = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        elapsed = time.perf_counter() - self._started_at
+        durations = self._trace.durations  # a phase is entered twice when the magazine is reloaded under the lock
+        durations[self._name] = durations.get(self._name, 0.0) + elapsed
+        self._trace.tracer.on_phase_end(self._name, self._trace, self._span, exc_val)
+
+
+def trace_phase(trace: Optional[TransitionTrace], name: str):
+
+    if trace is None:  # tracing is disabled or the transition is not sampled
+        return NULL_CONTEXT
+
+    return trace.phase(name)
+
+
+class AbstractTransitionTracer(ABC):
+
+    def start_trace(self, *, chat_id: int, user_id: int):
+
+        if not self.check_sampling():
+            return NULL_CONTEXT
+
+        return TransitionTrace(self, chat_id=chat_id, user_id=user_id)
+
+    def check_sampling(self) -> bool:
+
+        return True
+
+    def on_transition_start(self, trace: TransitionTrace) -> None:
+
+        pass
+
+    def on_transition_end(self, trace: TransitionTrace, error: Optional[BaseException]) -> None:
+
+        pass
+
+    @abstractmethod
+    def on_phase_start(self, phase: str, trace: TransitionTrace) -> Any:
+
+        pass
+
+    @abstractmethod
+    def on_phase_end(self, phase: str, trace: TransitionTrace, span: Any, error: Optional[BaseException]) -> None:
+
+        pass
+
+
+class PhaseStats:
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self) -> float:
+
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, seconds: float) -> None:
+
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class SamplingProfiler(AbstractTransitionTracer):
+
+    """Aggregates durations of phases per state for a sample of transitions.
+
+    Loading, locking and exit are attributed to the source state, enter and commit to the destination state.
+    """
+
+    def __init__(self, *, sample_rate: float = 0.01):
+
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample rate must be in the range (0, 1]!")
+
+        self.sample_rate = sample_rate
+        self._stats: Dict[Tuple[str, str], PhaseStats] = {}  # (state, phase) -> stats
+        self.failed_transitions = 0
+
+    def check_sampling(self) -> bool:
+
+        return random.random() < self.sample_rate
+
+    def on_phase_start(self, phase: str, trace: TransitionTrace) -> Any:
+
+        pass
+
+    def on_phase_end(self, phase: str, trace: TransitionTrace, span: Any, error: Optional[BaseException]) -> None:
+
+        pass
+
+    def on_transition_end(self, trace: TransitionTrace, error: Optional[BaseException]) -> None:
+
+        if error is not None:
+            self.failed_transitions += 1
+
+        for phase, seconds in trace.durations.items():
+            if phase in (ENTER_PHASE, COMMIT_PHASE):
+                state = trace.destination_state
+            else:
+                state = trace.source_state
+            if state is None:  # the transition is failed before the state is known
+                continue
+
+            key = (state.name, phase)
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = PhaseStats()
+            stats.add(seconds)
+
+    def get_stats(self) -> Dict[Tuple[str, str], PhaseStats]:
+
+        return dict(self._stats)
+
+    def report(self) -> List[dict]:
+
+        rows = [{"state": state, "phase": phase, "count": stats.count, "mean": stats.mean,
+                 "max": stats.max, "total": stats.total}
+                for (state, phase), stats in self._stats.items()]
+        rows.sort(key=lambda row: row["total"], reverse=True)
+
+        return rows
+
+    def reset(self) -> None:
+
+        self._stats.clear()
+        self.failed_transitions = 0
+
+
+class OpenTelemetryTracer(AbstractTransitionTracer):
+
+    def __init__(self, tracer=None):
+
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("""to use this tracer, you need to install «opentelemetry-api»!
+More info: https://opentelemetry.io/docs/instrumentation/python/""")
+
+        self._trace_api = trace
+        self._tracer = tracer or trace.get_tracer("aiogram_scenario")
+
+    def on_transition_start(self, trace: TransitionTrace) -> None:
+
+        trace.span = self._tracer.start_span("fsm.transition", attributes={"fsm.chat_id": trace.chat_id,
+                                                                           "fsm.user_id": trace.user_id})
+
+    def on_transition_end(self, trace: TransitionTrace, error: Optional[BaseException]) -> None:
+
+        if trace.source_state is not None:
+            trace.span.set_attribute("fsm.source_state", trace.source_state.name)
+        if trace.destination_state is not None:
+            trace.span.set_attribute("fsm.destination_state", trace.destination_state.name)
+        self._end_span(trace.span, error)
+
+    def on_phase_start(self, phase: str, trace: TransitionTrace) -> Any:
+
+        context = self._trace_api.set_span_in_context(trace.span)
+        return self._tracer.start_span(f"fsm.{phase}", context=context)
+
+    def on_phase_end(self, phase: str, trace: TransitionTrace, span: Any, error: Optional[BaseException]) -> None:
+
+        self._end_span(span, error)
+
+    def _end_span(self, span, error: Optional[BaseException]) -> None:
+
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(self._trace_api.Status(self._trace_api.StatusCode.ERROR))
+        span.end()
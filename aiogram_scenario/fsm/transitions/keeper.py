@@ -1,4 +1,4 @@
-from typing import Optional, Set
+from typing import Optional, Set, Iterator, Tuple
 
 from aiogram_scenario.fsm.state import BaseState
 from aiogram_scenario.fsm.types import TransitionsType
@@ -76,6 +76,13 @@ class TransitionsKeeper:
 
         return destination_state
 
+    def items(self) -> Iterator[Tuple[BaseState, str, Optional[str], BaseState]]:
+
+        for source_state in self._transitions:
+            for handler in self._transitions[source_state]:
+                for direction, destination_state in self._transitions[source_state][handler].items():
+                    yield source_state, handler, direction, destination_state
+
     def get_destination_state(self, source_state: BaseState,
                               handler: str, direction: Optional[str] = None) -> BaseState:
 
@@ -1,4 +1,4 @@
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .storages.base import AbstractLockingStorage
@@ -6,17 +6,19 @@ if TYPE_CHECKING:
 
 class LockContext:
 
-    __slots__ = ("_storage", "_chat_id", "_user_id")
+    __slots__ = ("_storage", "_chat_id", "_user_id", "_timeout")
 
-    def __init__(self, storage: "AbstractLockingStorage", *, chat_id: int, user_id: int):
+    def __init__(self, storage: "AbstractLockingStorage", *, chat_id: int, user_id: int,
+                 timeout: Optional[float] = None):
 
         self._storage = storage
         self._chat_id = chat_id
         self._user_id = user_id
+        self._timeout = timeout
 
     async def __aenter__(self):
 
-        await self._storage.add(chat_id=self._chat_id, user_id=self._user_id)
+        await self._storage.add(chat_id=self._chat_id, user_id=self._user_id, timeout=self._timeout)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
 
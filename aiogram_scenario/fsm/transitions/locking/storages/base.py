@@ -1,5 +1,8 @@
+import asyncio
 import logging
 from abc import ABC, abstractmethod
+from collections import deque
+from typing import Optional, Dict, Tuple, Deque
 
 from aiogram_scenario.fsm.transitions.locking.lock_context import LockContext
 from aiogram_scenario import errors
@@ -10,6 +13,8 @@ logger = logging.getLogger(__name__)
 
 class AbstractLockingStorage(ABC):
 
+    _waiters: Optional[Dict[Tuple[int, int], Deque[asyncio.Future]]] = None  # created on the first use
+
     @abstractmethod
     async def set(self, *, chat_id: int, user_id: int) -> None:
 
@@ -25,22 +30,124 @@ class AbstractLockingStorage(ABC):
 
         pass
 
-    def acquire(self, *, chat_id: int, user_id: int) -> LockContext:
+    def acquire(self, *, chat_id: int, user_id: int, timeout: Optional[float] = None) -> LockContext:
 
-        return LockContext(storage=self, chat_id=chat_id, user_id=user_id)
+        return LockContext(storage=self, chat_id=chat_id, user_id=user_id, timeout=timeout)
 
-    async def add(self, chat_id: int, user_id: int) -> None:
+    async def try_set(self, *, chat_id: int, user_id: int) -> bool:
 
         is_locked = await self.check(chat_id=chat_id, user_id=user_id)
         if is_locked:
-            raise errors.TransitionLockIsActiveError(chat_id=chat_id, user_id=user_id)
+            return False
 
         await self.set(chat_id=chat_id, user_id=user_id)
 
-        logger.debug(f"Lock is set for ({chat_id=}, {user_id=})!")
+        return True
+
+    async def add(self, chat_id: int, user_id: int, timeout: Optional[float] = None) -> bool:
+
+        """Sets the lock, returns True if it was waited for, so the locked data may be changed meanwhile."""
+
+        key = (chat_id, user_id)
+        if key in self._get_waiters():  # there is a queue, it cannot be bypassed
+            is_set = False
+        else:
+            is_set = await self.try_set(chat_id=chat_id, user_id=user_id)
+
+        if not is_set:
+            if timeout is None:
+                raise errors.TransitionLockIsActiveError(chat_id=chat_id, user_id=user_id)
+
+            await self._wait(key, timeout)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Lock is set for (chat_id=%s, user_id=%s)!", chat_id, user_id,
+                         extra={"chat_id": chat_id, "user_id": user_id})
+
+        return not is_set
 
     async def remove(self, *, chat_id: int, user_id: int) -> None:
 
         await self.unset(chat_id=chat_id, user_id=user_id)
-
-        logger.debug(f"Lock is unset ({chat_id=}, {user_id=})!")
+        self._wake_next((chat_id, user_id))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Lock is unset (chat_id=%s, user_id=%s)!", chat_id, user_id,
+                         extra={"chat_id": chat_id, "user_id": user_id})
+
+    async def _wait(self, key: Tuple[int, int], timeout: float) -> None:
+
+        chat_id, user_id = key
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        is_woken = False
+        while True:
+            future = loop.create_future()
+            waiters = self._get_waiters().setdefault(key, deque())
+            if is_woken:  # lock was intercepted, keep the place at the head of the queue
+                waiters.appendleft(future)
+            else:
+                waiters.append(future)
+
+            try:
+                await asyncio.wait_for(future, deadline - loop.time())
+            except asyncio.TimeoutError:
+                self._discard_waiter(key, future)
+                # a lock released by another process does not wake up waiters, so the last attempt
+                if await self.try_set(chat_id=chat_id, user_id=user_id):
+                    return
+                raise errors.TransitionLockIsActiveError(chat_id=chat_id, user_id=user_id)
+            except BaseException:
+                self._discard_waiter(key, future)
+                raise
+
+            try:
+                is_set = await self.try_set(chat_id=chat_id, user_id=user_id)
+            except BaseException:
+                self._wake_next(key)
+                raise
+
+            if is_set:
+                self._cleanup_waiters(key)
+                return
+
+            is_woken = True
+
+    def _get_waiters(self) -> Dict[Tuple[int, int], Deque[asyncio.Future]]:
+
+        if self._waiters is None:  # subclasses may not call __init__
+            self._waiters = {}
+
+        return self._waiters
+
+    def _wake_next(self, key: Tuple[int, int]) -> None:
+
+        waiters = self._get_waiters().get(key)
+        if waiters is None:
+            return
+
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return  # the queue is cleaned up by the woken waiter
+
+        del self._get_waiters()[key]
+
+    def _discard_waiter(self, key: Tuple[int, int], future: asyncio.Future) -> None:
+
+        waiters = self._get_waiters().get(key)
+        if waiters is None:
+            return
+
+        try:
+            waiters.remove(future)
+        except ValueError:  # already woken, the turn is passed to the next waiter
+            self._wake_next(key)
+        self._cleanup_waiters(key)
+
+    def _cleanup_waiters(self, key: Tuple[int, int]) -> None:
+
+        waiters = self._get_waiters().get(key)
+        if (waiters is not None) and (not waiters):
+            del self._get_waiters()[key]
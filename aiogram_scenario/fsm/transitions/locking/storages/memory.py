@@ -5,6 +5,7 @@ class MemoryLockingStorage(AbstractLockingStorage):
 
     def __init__(self):
 
+        super().__init__()
         self._locks = {}
 
     async def set(self, *, chat_id: int, user_id: int) -> None:
@@ -0,0 +1,79 @@
+from typing import Dict, Tuple
+import hashlib
+import secrets
+
+from .base import AbstractLockingStorage
+from aiogram_scenario.fsm.storages.redis import RedisStorage
+from aiogram_scenario import errors
+
+
+LOCK_KEY = "lock"
+
+# KEYS - lock keys, ARGV - owner tokens of the same locks
+RELEASE_LOCKS_SCRIPT = """
+local released = 0
+for index = 1, #KEYS do
+    if redis.call('GET', KEYS[index]) == ARGV[index] then
+        released = released + redis.call('DEL', KEYS[index])
+    end
+end
+
+return released
+"""
+RELEASE_LOCKS_SCRIPT_SHA = hashlib.sha1(RELEASE_LOCKS_SCRIPT.encode()).hexdigest()
+
+
+class RedisLockingStorage(AbstractLockingStorage):
+
+    def __init__(self, storage: RedisStorage, *, lease_ttl: int = 30000):
+
+        super().__init__()
+        self._storage = storage
+        self._lease_ttl = lease_ttl  # in milliseconds, the lock is released by Redis if the owner is lost
+        self._tokens: Dict[Tuple[int, int], str] = {}
+
+    async def set(self, *, chat_id: int, user_id: int) -> None:
+
+        is_set = await self.try_set(chat_id=chat_id, user_id=user_id)
+        if not is_set:
+            raise errors.TransitionLockIsActiveError(chat_id=chat_id, user_id=user_id)
+
+    async def try_set(self, *, chat_id: int, user_id: int) -> bool:
+
+        token = secrets.token_hex(16)
+        redis_ = await self._storage.redis()
+        is_set = await redis_.set(self._get_key(chat_id, user_id), token,
+                                  pexpire=self._lease_ttl, exist=redis_.SET_IF_NOT_EXIST)
+        if is_set:
+            self._tokens[(chat_id, user_id)] = token
+
+        return bool(is_set)
+
+    async def unset(self, *, chat_id: int, user_id: int) -> None:
+
+        await self._release({(chat_id, user_id): self._tokens.pop((chat_id, user_id))})
+
+    async def check(self, *, chat_id: int, user_id: int) -> bool:
+
+        redis_ = await self._storage.redis()
+        return bool(await redis_.exists(self._get_key(chat_id, user_id)))
+
+    async def release_all(self) -> None:
+
+        tokens, self._tokens = self._tokens, {}
+        if tokens:
+            await self._release(tokens)
+
+    async def close(self) -> None:
+
+        await self.release_all()
+
+    async def _release(self, tokens: Dict[Tuple[int, int], str]) -> None:
+
+        keys = [self._get_key(chat_id, user_id) for chat_id, user_id in tokens]
+        await self._storage.execute_script(RELEASE_LOCKS_SCRIPT, RELEASE_LOCKS_SCRIPT_SHA,
+                                           keys=keys, args=list(tokens.values()))
+
+    def _get_key(self, chat_id: int, user_id: int) -> str:
+
+        return self._storage.generate_key(chat_id, user_id, LOCK_KEY)
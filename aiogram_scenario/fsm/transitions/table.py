@@ -0,0 +1,82 @@
+from typing import Optional, Dict, FrozenSet
+
+from aiogram_scenario.fsm.state import BaseState
+from aiogram_scenario.fsm.states_mapping import StatesMapping
+from .keeper import TransitionsKeeper
+from aiogram_scenario import errors
+
+
+class TransitionsTable:
+
+    """Frozen transitions prepared for lookups.
+
+    Transitions without a direction, the usual case, are found by two dict lookups (source state, then
+    handler) instead of three ones of TransitionsKeeper. The states are kept in a frozenset (the keeper
+    copies its set on every access), and values are mapped to states by one dict lookup.
+    """
+
+    __slots__ = ("_states", "_values_states", "_states_values", "_index", "_directed_index", "_length")
+
+    def __init__(self, keeper: TransitionsKeeper, states_mapping: StatesMapping):
+
+        self._values_states: Dict[Optional[str], BaseState] = dict(states_mapping.items())
+        self._states_values: Dict[BaseState, Optional[str]] = {state: value for value, state
+                                                                in states_mapping.items()}
+
+        index: Dict[BaseState, Dict[str, BaseState]] = {}  # without a direction
+        directed_index: Dict[BaseState, Dict[str, Dict[str, BaseState]]] = {}
+        length = 0
+        for source_state, handler, direction, destination_state in keeper.items():
+            if direction is None:
+                index.setdefault(source_state, {})[handler] = destination_state
+            else:
+                directed_index.setdefault(source_state, {}).setdefault(handler, {})[direction] = destination_state
+            length += 1
+
+        self._states = frozenset(keeper.states)
+        self._index = index
+        self._directed_index = directed_index
+        self._length = length
+
+    def __len__(self):
+
+        return self._length
+
+    @property
+    def states(self) -> FrozenSet[BaseState]:
+
+        return self._states
+
+    def get_state(self, value: Optional[str]) -> BaseState:
+
+        try:
+            return self._values_states[value]
+        except KeyError:
+            raise errors.StateValueNotFoundError(value)
+
+    def get_value(self, state: BaseState) -> Optional[str]:
+
+        try:
+            return self._states_values[state]
+        except KeyError:
+            raise errors.StateNotFoundError(state)
+
+    def check(self, *, source_state: BaseState, destination_state: BaseState,
+              handler: str, direction: Optional[str] = None) -> bool:
+
+        try:
+            return self.get_destination_state(source_state, handler, direction) is destination_state
+        except errors.TransitionNotFoundError:
+            return False
+
+    def get_destination_state(self, source_state: BaseState,
+                              handler: str, direction: Optional[str] = None) -> BaseState:
+
+        try:
+            if direction is None:
+                return self._index[source_state][handler]
+
+            return self._directed_index[source_state][handler][direction]
+        except KeyError:
+            raise errors.TransitionNotFoundError(source_state=source_state, handler=handler,
+                                                 direction=direction)
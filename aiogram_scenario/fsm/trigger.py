@@ -83,7 +83,10 @@ class FSMTrigger:
         chat_id, user_id = helpers.normalize_telegram_ids(chat_id=chat_id, user_id=user_id)
         handler = handler.__name__
 
-        logger.debug(f"FSM received a request to move to next state ({chat_id=}, {user_id=})...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("FSM received a request to move to next state (chat_id=%s, user_id=%s)...",
+                         chat_id, user_id, extra={"chat_id": chat_id, "user_id": user_id, "handler": handler,
+                                                  "direction": direction})
 
         await self._fsm.execute_next_transition(chat_id=chat_id, user_id=user_id, handler=handler,
                                                 direction=direction, processing_args=(event,),
@@ -94,7 +97,9 @@ class FSMTrigger:
         chat_id, user_id, _, event, context_data = _get_context_items()
         chat_id, user_id = helpers.normalize_telegram_ids(chat_id=chat_id, user_id=user_id)
 
-        logger.debug(f"FSM received a request to move to previous state ({chat_id=}, {user_id=})...")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("FSM received a request to move to previous state (chat_id=%s, user_id=%s)...",
+                         chat_id, user_id, extra={"chat_id": chat_id, "user_id": user_id})
 
         await self._fsm.execute_back_transition(chat_id=chat_id, user_id=user_id, processing_args=(event,),
                                                 processing_kwargs=context_data)
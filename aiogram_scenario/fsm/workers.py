@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import inspect
+import logging
+import multiprocessing
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union, Awaitable, List, Optional, Hashable, Set
+
+from aiogram import Dispatcher, Bot, types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from .scheduler import get_update_address
+
+
+logger = logging.getLogger(__name__)
+
+
+DispatcherFactoryType = Callable[[], Union[Dispatcher, Awaitable[Dispatcher]]]
+
+
+def _hash(value: str) -> int:
+
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+
+    """Maps keys to nodes, so changing the number of nodes moves only a small part of keys."""
+
+    def __init__(self, nodes: List[Hashable], *, virtual_nodes: int = 100):
+
+        if not nodes:
+            raise ValueError("at least one node is required!")
+        if virtual_nodes < 1:
+            raise ValueError("number of virtual nodes must be a positive number!")
+
+        points = sorted((_hash(f"{node}#{index}"), node) for node in nodes for index in range(virtual_nodes))
+        self._hashes = [point_hash for point_hash, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key: Hashable) -> Hashable:
+
+        index = bisect(self._hashes, _hash(repr(key)))
+        return self._nodes[index % len(self._nodes)]
+
+
+class _Worker:
+
+    __slots__ = ("index", "process", "connection")
+
+    def __init__(self, index: int, process: multiprocessing.Process, connection):
+
+        self.index = index
+        self.process = process
+        self.connection = connection
+
+
+class WorkersPool:
+
+    """Processes updates in worker processes, updates of the same (chat, user) always go to the same worker.
+
+    Every worker builds its own dispatcher (with its FSM and storage) by the factory after the fork, so states
+    and transition locks of a user stay local to one process. The supervisor puts updates into bounded queues
+    of workers, and a task per worker sends them over the pipe in a thread, so a full pipe of a slow worker
+    blocks neither the event loop nor other workers. Dead workers are restarted in the thread too.
+    """
+
+    def __init__(self, dispatcher_factory: DispatcherFactoryType, *, workers_number: Optional[int] = None,
+                 virtual_nodes: int = 100, start_method: str = "fork", max_queue_size: int = 1000):
+
+        if max_queue_size < 1:
+            raise ValueError("max queue size must be a positive number!")
+
+        self.workers_number = workers_number or multiprocessing.cpu_count()
+        self.max_queue_size = max_queue_size
+        self._dispatcher_factory = dispatcher_factory
+        self._context = multiprocessing.get_context(start_method)
+        self._ring = ConsistentHashRing(list(range(self.workers_number)), virtual_nodes=virtual_nodes)
+        self._workers: List[Optional[_Worker]] = [None] * self.workers_number
+        self._queues: List[Optional[asyncio.Queue]] = [None] * self.workers_number  # created in the loop
+        self._senders: List[Optional[asyncio.Task]] = [None] * self.workers_number
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def is_started(self) -> bool:
+
+        return any(worker is not None for worker in self._workers)
+
+    def start(self) -> None:
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers_number,
+                                            thread_name_prefix="aiogram_scenario_workers")
+        for index in range(self.workers_number):
+            self._start_worker(index)
+
+        logger.info("Workers pool is started (%s workers)!", self.workers_number)
+
+    async def stop(self, *, timeout: float = 10.0) -> None:
+
+        loop = asyncio.get_running_loop()
+        for index in range(self.workers_number):
+            if self._senders[index] is not None:  # the sender sends the queued updates and stops the worker
+                await self._queues[index].put(None)
+            elif self._workers[index] is not None:
+                await loop.run_in_executor(self._executor, _send_stopping, self._workers[index].connection)
+
+        senders = [sender for sender in self._senders if sender is not None]
+        if senders:
+            await asyncio.gather(*senders, return_exceptions=True)
+        self._queues = [None] * self.workers_number
+        self._senders = [None] * self.workers_number
+
+        await loop.run_in_executor(self._executor, self._join_workers, timeout)
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+        logger.info("Workers pool is stopped!")
+
+    def get_worker_index(self, update: types.Update) -> int:
+
+        address = get_update_address(update)
+        key = address if address is not None else update.update_id
+
+        return self._ring.get_node(key)
+
+    async def send_update(self, update: types.Update) -> None:
+
+        """Queues the update to its worker, waits while the queue of the worker is full."""
+
+        index = self.get_worker_index(update)
+        queue = self._queues[index]
+        if queue is None:
+            queue = self._queues[index] = asyncio.Queue(self.max_queue_size)
+            self._senders[index] = asyncio.get_running_loop().create_task(self._send_updates(index, queue))
+
+        await queue.put(update.to_python())
+
+    async def _send_updates(self, index: int, queue: asyncio.Queue) -> None:
+
+        is_stopping = False
+        while not is_stopping:
+            raw_updates = [await queue.get()]
+            while not queue.empty():
+                raw_updates.append(queue.get_nowait())
+            is_stopping = None in raw_updates  # the worker stops after the received updates
+
+            raw_updates.reverse()  # updates are popped from the end while sending
+            try:
+                await self._send_to_worker(index, raw_updates)
+            except Exception:
+                lost_number = sum(raw_update is not None for raw_update in raw_updates)
+                logger.exception("Sending to worker %s has failed, %s updates are lost!", index, lost_number)
+
+    async def _send_to_worker(self, index: int, raw_updates: List[Optional[dict]]) -> None:
+
+        loop = asyncio.get_running_loop()
+        worker = self._workers[index]
+        if (worker is None) or (not worker.process.is_alive()):
+            exit_code = worker.process.exitcode if worker is not None else None
+            logger.error("Worker %s is not alive (exit code %s), updates sent to it and not processed are lost, "
+                         "it is restarted!", index, exit_code)
+            worker = await loop.run_in_executor(self._executor, self._start_worker, index)
+
+        try:
+            await loop.run_in_executor(self._executor, _send_all, worker.connection, raw_updates)
+        except (BrokenPipeError, OSError):  # the unsent updates are sent to the restarted worker
+            logger.error("Worker %s has closed the pipe, it is restarted!", index)
+            worker = await loop.run_in_executor(self._executor, self._restart_worker, index)
+            await loop.run_in_executor(self._executor, _send_all, worker.connection, raw_updates)
+
+    def _start_worker(self, index: int) -> _Worker:
+
+        previous_worker = self._workers[index]
+        if previous_worker is not None:
+            previous_worker.connection.close()
+
+        reading_connection, writing_connection = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_run_worker, args=(self._dispatcher_factory, reading_connection, index),
+                                        name=f"aiogram_scenario_worker_{index}", daemon=True)
+        process.start()
+        reading_connection.close()  # the reading end belongs to the worker
+
+        worker = self._workers[index] = _Worker(index, process, writing_connection)
+        return worker
+
+    def _restart_worker(self, index: int) -> _Worker:
+
+        previous_worker = self._workers[index]
+        if (previous_worker is not None) and previous_worker.process.is_alive():
+            previous_worker.process.terminate()
+            previous_worker.process.join()
+
+        return self._start_worker(index)
+
+    def _join_workers(self, timeout: float) -> None:
+
+        for index, worker in enumerate(self._workers):
+            if worker is None:
+                continue
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                logger.warning("Worker %s is not stopped in time, it is terminated!", index)
+                worker.process.terminate()
+                worker.process.join()
+            worker.connection.close()
+            self._workers[index] = None
+
+
+class WorkersPoolMiddleware(BaseMiddleware):
+
+    """Sends updates of the supervisor dispatcher to the workers pool instead of processing them."""
+
+    def __init__(self, pool: WorkersPool):
+
+        super().__init__()
+        self._pool = pool
+
+    async def on_pre_process_update(self, update: types.Update, data: dict) -> None:
+
+        await self._pool.send_update(update)
+        raise CancelHandler()
+
+
+def _send_all(connection, raw_updates: List[Optional[dict]]) -> None:
+
+    """Runs in the thread, sent updates are removed from the end of the list."""
+
+    while raw_updates:
+        connection.send(raw_updates[-1])
+        raw_updates.pop()
+
+
+def _send_stopping(connection) -> None:
+
+    try:
+        connection.send(None)  # processes the received updates and exits
+    except (BrokenPipeError, OSError):
+        pass
+
+
+def _run_worker(dispatcher_factory: DispatcherFactoryType, connection, index: int) -> None:
+
+    try:
+        asyncio.run(_serve_worker(dispatcher_factory, connection, index))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve_worker(dispatcher_factory: DispatcherFactoryType, connection, index: int) -> None:
+
+    dispatcher = dispatcher_factory()
+    if inspect.isawaitable(dispatcher):
+        dispatcher = await dispatcher
+    Dispatcher.set_current(dispatcher)
+    Bot.set_current(dispatcher.bot)
+
+    loop = asyncio.get_running_loop()
+    tasks: Set[asyncio.Task] = set()
+    stopping = loop.create_future()
+
+    def receive() -> None:
+
+        while connection.poll():
+            try:
+                raw_update = connection.recv()
+            except EOFError:  # the supervisor is gone
+                raw_update = None
+
+            if raw_update is None:
+                loop.remove_reader(connection.fileno())
+                if not stopping.done():
+                    stopping.set_result(None)
+                return
+
+            task = loop.create_task(_process_update(dispatcher, raw_update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    loop.add_reader(connection.fileno(), receive)
+    logger.info("Worker %s is started!", index)
+
+    await stopping
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    await dispatcher.storage.close()
+    await dispatcher.storage.wait_closed()
+    session = await dispatcher.bot.get_session()
+    await session.close()
+    connection.close()
+    logger.info("Worker %s is stopped!", index)
+
+
+async def _process_update(dispatcher: Dispatcher, raw_update: dict) -> None:
+
+    try:
+        await dispatcher.updates_handler.notify(types.Update(**raw_update))
+    except Exception:
+        logger.exception("Update processing has failed in the worker!")
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+import itertools
+import sys
+
+from .storages import STORAGES_FACTORIES, create_storage
+from .transitions import OPERATIONS, BenchmarkResult, run_benchmark
+
+
+def _parse_args() -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Transitions throughput and latency benchmark.")
+    parser.add_argument("--storages", nargs="+", choices=tuple(STORAGES_FACTORIES), default=["memory"])
+    parser.add_argument("--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument("--states", nargs="+", type=int, default=[10, 500], help="sizes of the states graph")
+    parser.add_argument("--depths", nargs="+", type=int, default=[0, 16], help="magazine depths (0 - unlimited)")
+    parser.add_argument("--pairs", type=int, default=100, help="number of concurrent (chat, user) pairs")
+    parser.add_argument("--transitions", type=int, default=100, help="number of transitions per pair")
+    parser.add_argument("--no-freeze", action="store_true", help="do not freeze FSM before the measure")
+    parser.add_argument("--redis", default=None, help="Redis address, 'localhost:6379' by default")
+    parser.add_argument("--mongo", default=None, help="MongoDB URI, 'mongodb://localhost:27017' by default")
+
+    return parser.parse_args()
+
+
+async def _main(args: argparse.Namespace) -> None:
+
+    addresses = {"redis": args.redis, "mongo": args.mongo}
+
+    print(BenchmarkResult.format_header())
+    for storage_name in args.storages:
+        for operation, states, depth in itertools.product(args.operations, args.states, args.depths):
+            try:
+                storage = await create_storage(storage_name, addresses.get(storage_name))
+            except (OSError, ConnectionError) as error:
+                print(f"{storage_name:<8} skipped: {error}", file=sys.stderr)
+                break
+
+            try:
+                result = await run_benchmark(storage_name, storage, operation=operation, states=states,
+                                             depth=depth or None, pairs=args.pairs, transitions=args.transitions,
+                                             freeze=not args.no_freeze)
+            finally:
+                await storage.close()
+                await storage.wait_closed()
+
+            print(result.format())
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(_parse_args()))
@@ -0,0 +1,40 @@
+from typing import Optional, Callable, Dict
+
+from aiogram_scenario.fsm.storages.base import BaseStorage
+from aiogram_scenario.fsm.storages.memory import MemoryStorage
+
+
+def _create_memory_storage(_: Optional[str]) -> BaseStorage:
+
+    return MemoryStorage()
+
+
+def _create_redis_storage(address: Optional[str]) -> BaseStorage:
+
+    from aiogram_scenario.fsm.storages.redis import RedisStorage
+
+    host, _, port = (address or "localhost:6379").partition(":")
+    return RedisStorage(host=host, port=int(port or 6379), prefix="aiogram_scenario_benchmark")
+
+
+def _create_mongo_storage(uri: Optional[str]) -> BaseStorage:
+
+    from aiogram_scenario.fsm.storages.mongo import MongoStorage
+
+    return MongoStorage(uri=uri or "mongodb://localhost:27017", db_name="aiogram_scenario_benchmark")
+
+
+STORAGES_FACTORIES: Dict[str, Callable[[Optional[str]], BaseStorage]] = {
+    "memory": _create_memory_storage,
+    "redis": _create_redis_storage,
+    "mongo": _create_mongo_storage
+}
+
+
+async def create_storage(name: str, address: Optional[str] = None) -> BaseStorage:
+
+    storage = STORAGES_FACTORIES[name](address)
+    if name != "memory":
+        await storage.reset_all(full=False)  # only keys and collections of the benchmark
+
+    return storage
@@ -0,0 +1,178 @@
+import asyncio
+import gc
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import List, Optional, Callable, Awaitable
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.handler import current_handler, ctx_data
+
+from aiogram_scenario import FSM, FSMTrigger, BaseState
+from aiogram_scenario.fsm.storages.base import BaseStorage
+
+
+BOT_TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+OPERATIONS = ("next", "back", "trigger")
+
+
+class BenchmarkState(BaseState):
+
+    async def process_enter(self, event, **kwargs) -> None:
+
+        pass
+
+    async def process_exit(self, event, **kwargs) -> None:
+
+        pass
+
+
+async def go_next(*_, **__) -> None:  # handler name used in transitions
+
+    pass
+
+
+@dataclass
+class BenchmarkResult:
+
+    storage: str
+    operation: str
+    states: int
+    depth: Optional[int]
+    pairs: int
+    transitions: int
+    elapsed: float
+    latencies: List[float]
+    retained_blocks_per_transition: float
+    peak_memory: int
+
+    @property
+    def ops_per_second(self) -> float:
+
+        return self.transitions / self.elapsed
+
+    def get_percentile(self, percentile: int) -> float:
+
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+
+        return statistics.quantiles(self.latencies, n=100)[percentile - 1]
+
+    def format(self) -> str:
+
+        depth = self.depth if self.depth is not None else "-"
+        return (f"{self.storage:<8} {self.operation:<8} {self.states:>7} {depth:>6} {self.pairs:>7} "
+                f"{self.ops_per_second:>12.1f} {self.get_percentile(50) * 1e6:>10.1f} "
+                f"{self.get_percentile(99) * 1e6:>10.1f} {self.retained_blocks_per_transition:>18.2f} "
+                f"{self.peak_memory / 1024:>10.1f}")
+
+    @staticmethod
+    def format_header() -> str:
+
+        return (f"{'storage':<8} {'op':<8} {'states':>7} {'depth':>6} {'pairs':>7} {'ops/sec':>12} "
+                f"{'p50, us':>10} {'p99, us':>10} {'retained blocks/op':>18} {'peak, KiB':>10}")
+
+
+def create_fsm(storage: BaseStorage, states_number: int, depth: Optional[int], freeze: bool = True) -> FSM:
+
+    dispatcher = Dispatcher(Bot(BOT_TOKEN), storage=storage)
+    states = [BenchmarkState(name=f"State{i}") for i in range(states_number)]
+    fsm = FSM(dispatcher, initial_state=states[0], magazine_depth=depth)
+    for index, state in enumerate(states):  # ring of states
+        fsm.add_transition(state, states[(index + 1) % states_number], go_next)
+    if freeze:
+        fsm.freeze()
+
+    return fsm
+
+
+def _create_update(chat_id: int, user_id: int) -> types.Update:
+
+    return types.Update(**{
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Benchmark"},
+            "text": "benchmark"
+        }
+    })
+
+
+def _get_operation(fsm: FSM, operation: str, chat_id: int, user_id: int) -> Callable[[int], Awaitable[None]]:
+
+    trigger = FSMTrigger(fsm)
+    update = _create_update(chat_id, user_id)
+
+    async def execute_next_transition(_: int) -> None:
+
+        await fsm.execute_next_transition(chat_id=chat_id, user_id=user_id, handler=go_next.__name__,
+                                          processing_args=(update.message,))
+
+    async def execute_next_or_back_transition(index: int) -> None:
+
+        if index % 2:
+            await fsm.execute_back_transition(chat_id=chat_id, user_id=user_id, processing_args=(update.message,))
+        else:
+            await execute_next_transition(index)
+
+    async def go_next_by_trigger(_: int) -> None:
+
+        types.Update.set_current(update)
+        types.Chat.set_current(update.message.chat)
+        types.User.set_current(update.message.from_user)
+        current_handler.set(go_next)
+        ctx_data.set({})
+        await trigger.go_next()
+
+    return {
+        "next": execute_next_transition,
+        "back": execute_next_or_back_transition,
+        "trigger": go_next_by_trigger
+    }[operation]
+
+
+async def _run_pair(fsm: FSM, operation: str, chat_id: int, user_id: int,
+                    transitions: int, latencies: List[float]) -> None:
+
+    execute = _get_operation(fsm, operation, chat_id, user_id)
+    for index in range(transitions):
+        started = time.perf_counter()
+        await execute(index)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_benchmark(storage_name: str, storage: BaseStorage, *, operation: str, states: int,
+                        depth: Optional[int], pairs: int, transitions: int, freeze: bool = True) -> BenchmarkResult:
+
+    fsm = create_fsm(storage, states, depth, freeze)
+
+    latencies: List[float] = []
+    await asyncio.gather(*(_run_pair(fsm, operation, -pair, pair, 1, []) for pair in range(1, pairs + 1)))  # warm-up
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_run_pair(fsm, operation, -pair, pair, transitions, latencies)
+                           for pair in range(1, pairs + 1)))
+    elapsed = time.perf_counter() - started
+
+    # memory is measured by a separate pass, tracing distorts the timings
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    try:
+        await asyncio.gather(*(_run_pair(fsm, operation, -pair, pair, transitions, [])
+                               for pair in range(1, pairs + 1)))
+        blocks = sys.getallocatedblocks() - blocks
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+
+    total = pairs * transitions
+    return BenchmarkResult(storage=storage_name, operation=operation, states=states, depth=depth,
+                           pairs=pairs, transitions=total, elapsed=elapsed, latencies=latencies,
+                           retained_blocks_per_transition=blocks / total, peak_memory=peak_memory)
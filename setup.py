@@ -24,7 +24,7 @@ def fetch_long_description() -> str:
 setuptools.setup(
     name="aiogram-scenario",
     version=fetch_version(),
-    packages=setuptools.find_packages(exclude=("tests", "docs")),
+    packages=setuptools.find_packages(exclude=("tests", "docs", "benchmarks")),
     url="https://github.com/Abstract-X/aiogram-scenario",
     license="MIT",
     author="Abstract-X",